@@ -1,51 +1,323 @@
+import os
+import hashlib
+import tempfile
+import threading
+from contextlib import ExitStack
+from pathlib import Path
+from group_commit import GroupCommitter, sync_paths
+from chunk_index import ChunkIndex, ManifestVerifier
+
 class AccountManager:
     def __init__(self, config, storage_provider, account_service):
         self.config = config
         self.storage = storage_provider  # Especialista em pastas
         self.service = account_service   # Especialista em regras de negócio
+        # A sincronização concorrente pode registrar contas de vários peers ao mesmo tempo
+        self._lock = threading.Lock()
         
         # Carrega as contas usando o serviço
         self.accounts = self.service.load_all_accounts()
+        # Índice por usuário (consulta O(1)) e versão da lista, usada no ETag do /accounts
+        self._by_user = {acc['user']: acc for acc in self.accounts}
+        self.accounts_version = 0
+        # Callbacks chamados após cada commit de envelope (ex: anúncio aos peers)
+        self._commit_listeners = []
+        # Callbacks chamados quando a lista de contas muda (ex: cache de respostas do servidor)
+        self._accounts_listeners = []
+        # Commits de envelopes agrupados em lotes (uma atualização do índice por usuário e lote)
+        self.committer = GroupCommitter(config, self._commit_batch)
+        # Manifestos dos envelopes em chunks (sync delta entre versões de um mesmo arquivo)
+        self.chunks = ChunkIndex(storage_provider, account_service.references)
+        # As pastas são criadas uma vez aqui; as consultas seguintes vêm do cache do provider
+        for user_id in self._by_user:
+            self.storage.provision_user(user_id)
         print(f"[*] AccountManager: {len(self.accounts)} contas inicializadas via Service.")
 
     def get_user_folder_name(self, user_id: str):
         # Apenas repassa a responsabilidade para o provedor de storage
         return self.storage.get_user_folder_name(user_id)
 
+    def get_account(self, user_id: str):
+        return self._by_user.get(user_id)
+
     def add_account(self, account_data):
         """Usa o serviço para validar e salvar uma nova conta."""
-        if any(acc['user'] == account_data['user'] for acc in self.accounts):
-            return False
-            
-        self.accounts.append(account_data)
-        self.service.save_account(self.accounts)
-        print(f"[*] Conta '{account_data['user']}' persistida com sucesso.")
-        return True
+        return self.merge_accounts([account_data]) > 0
+
+    def merge_accounts(self, accounts_list):
+        """Registra as contas ainda desconhecidas e persiste o lote de uma só vez."""
+        with self._lock:
+            new_accounts = []
+            for acc in accounts_list:
+                user_id = acc.get('user')
+                if not user_id or user_id in self._by_user:
+                    continue
+                self._by_user[user_id] = acc
+                new_accounts.append(acc)
+
+            if not new_accounts:
+                return 0
+
+            self.accounts.extend(new_accounts)
+            self.accounts_version += 1
+            self.service.add_accounts(new_accounts, self.accounts)
+
+        for acc in new_accounts:
+            self.storage.provision_user(acc['user'])
+            print(f"[*] Conta '{acc['user']}' persistida com sucesso.")
+        for callback in self._accounts_listeners:
+            try:
+                callback(new_accounts)
+            except Exception as e:
+                print(f"[!] Erro em listener de contas: {e}")
+        return len(new_accounts)
 
     def get_local_sequence(self, user_id: str):
-        """Busca a sequência no storage através do caminho resolvido pelo provider."""
-        ref_path = self.storage.get_user_storage_path(user_id) / "references.json"
-        if ref_path.exists():
-            import json
+        """Busca a sequência no índice de referências em memória (sem parse do arquivo)."""
+        return self.service.references.get_sequence(user_id)
+
+    def add_commit_listener(self, callback):
+        """Registra callback(user_id, sequence, file_hash) chamado após cada envelope gravado."""
+        self._commit_listeners.append(callback)
+
+    def add_accounts_listener(self, callback):
+        """Registra callback(novas_contas) chamado após cada lote de contas persistido."""
+        self._accounts_listeners.append(callback)
+
+    def _notify_commit(self, user_id, sequence, file_hash):
+        for callback in self._commit_listeners:
             try:
-                with open(ref_path, "r") as f:
-                    return json.load(f).get("sequence", 0)
-            except: pass
-        return 0
+                callback(user_id, sequence, file_hash)
+            except Exception as e:
+                print(f"[!] Erro em listener de commit: {e}")
+
+    def has_sequence(self, user_id: str, sequence: int):
+        return self.service.references.has(user_id, sequence)
+
+    def get_contiguous_sequence(self, user_id: str):
+        """Maior sequência k tal que 1..k estão todas presentes (antes da primeira lacuna)."""
+        return self.service.references.get_digest(user_id)["head"]
+
+    def get_missing_sequences(self, user_id: str, remote_runs):
+        """Sequências anunciadas pelo peer (faixas) que faltam localmente, inclusive lacunas antigas."""
+        return self.service.references.get_missing(user_id, remote_runs)
+
+    def get_digest(self, user_id: str, sequence=None):
+        """Raiz (ou digest em `sequence`) da cadeia de hashes do histórico local do usuário."""
+        return self.service.references.get_digest(user_id, sequence)
 
     def save_remote_envelope(self, user_id, data_bytes, sequence, file_hash):
         """Coordena o salvamento do arquivo e a atualização do mapa de referências."""
+        return self.receive_envelope(user_id, [data_bytes], sequence, file_hash)
+
+    def get_partial_path(self, user_id, sequence) -> Path:
+        """Caminho do download parcial (.part) mantido entre rodadas para retomada."""
+        filename = f"{str(sequence).zfill(4)}.dat.gz"
+        return self.storage.get_user_storage_path(user_id) / f"{filename}.part"
+
+    def receive_envelope(self, user_id, chunks, sequence, file_hash, partial_offset=None, wait=True, manifest=None):
+        """Grava o envelope bloco a bloco em um temporário, valida o SHA-256 e o move atomicamente.
+
+        Com `partial_offset` o temporário é o arquivo .part, truncado nesse offset e continuado;
+        se a transferência cair, os bytes recebidos ficam guardados para a próxima tentativa.
+        Com `wait=False` retorna o Future do commit em grupo (o chamador segue recebendo).
+        `manifest` (envelopes em chunks) é conferido membro a membro durante a gravação e só
+        é guardado junto com o envelope se descrever exatamente os bytes recebidos.
+        """
         user_dir = self.storage.get_user_storage_path(user_id)
         filename = f"{str(sequence).zfill(4)}.dat.gz"
-        file_path = user_dir / filename
-        
+        hasher = hashlib.sha256()
+        verifier = ManifestVerifier(manifest) if manifest is not None else None
+
+        if partial_offset is None:
+            # O temporário fica na mesma pasta para que o rename seja atômico
+            fd, tmp_name = tempfile.mkstemp(dir=user_dir, prefix=f"{filename}.", suffix=".tmp")
+            tmp_path = Path(tmp_name)
+            out = os.fdopen(fd, "wb")
+        else:
+            tmp_path = self.get_partial_path(user_id, sequence)
+            out = open(tmp_path, "r+b" if tmp_path.exists() else "wb")
+            out.truncate(partial_offset)
+            # O hash continua a partir dos bytes que já estavam no disco
+            while out.tell() < partial_offset:
+                block = out.read(1024 * 1024)
+                if not block:
+                    break
+                hasher.update(block)
+                if verifier is not None:
+                    verifier.update(block)
+            out.seek(partial_offset)
+
         try:
-            with open(file_path, "wb") as f:
-                f.write(data_bytes)
-            
-            # Delega a atualização do JSON de referência para o serviço
-            self.service.update_references(user_id, sequence, file_hash)
-            return True
+            with out as f:
+                for chunk in chunks:
+                    hasher.update(chunk)
+                    if verifier is not None:
+                        verifier.update(chunk)
+                    f.write(chunk)
+
+            # Um envelope truncado ou corrompido nunca chega ao caminho final
+            computed_hash = hasher.hexdigest()
+            if file_hash and computed_hash != file_hash:
+                print(f"[!] Hash divergente para {filename} de {user_id}: esperado {file_hash}, recebido {computed_hash}")
+                tmp_path.unlink(missing_ok=True)
+                return False
+
+            if verifier is not None and not verifier.matches():
+                # O envelope vale (hash conferido); só o manifesto do peer é descartado
+                print(f"[!] Manifesto de {filename} de {user_id} não corresponde ao envelope; gravando sem chunks")
+                manifest = None
+
+            future = self.submit_envelope_file(user_id, tmp_path, sequence, file_hash or computed_hash, manifest)
+            return future.result() is not None if wait else future
         except Exception as e:
             print(f"[!] Erro ao salvar envelope: {e}")
-            return False
\ No newline at end of file
+            if partial_offset is None:
+                tmp_path.unlink(missing_ok=True)
+            return False
+
+    def submit_envelope_file(self, user_id, tmp_path, sequence, file_hash, manifest=None):
+        """Enfileira o commit no próximo lote; o Future resolve com a sequência ou None.
+
+        A sequência só é gravada se ainda estiver livre: um envelope local e um vindo de
+        um peer nunca se sobrescrevem.
+        """
+        return self.committer.submit(user_id, tmp_path, sequence, file_hash, manifest)
+
+    def submit_new_envelope(self, user_id, tmp_path, file_hash, manifest=None):
+        """Como `submit_envelope_file`, mas a sequência é alocada no commit, na ordem de envio.
+
+        Alocação e commit acontecem sob o mesmo lock, então dois produtores nunca recebem
+        a mesma sequência.
+        """
+        return self.committer.submit(user_id, tmp_path, None, file_hash, manifest)
+
+    def _commit_batch(self, batch):
+        """Commit em grupo: renomeia os envelopes, sincroniza o disco uma vez e atualiza o índice por usuário.
+
+        Uma falha afeta só os envelopes envolvidos: os que foram gravados e indexados recebem a
+        sequência; os demais recebem None, sem deixar envelope no caminho final fora do índice.
+        """
+        by_user = {}
+        for request in batch:
+            by_user.setdefault(request.user_id, []).append(request)
+
+        placed = {}
+        with ExitStack() as stack:
+            # Locks de todos os usuários do lote, sempre na mesma ordem (sem deadlock)
+            locks = {id(lock): lock for lock in (self.storage.user_lock(u) for u in by_user)}
+            for _, lock in sorted(locks.items()):
+                stack.enter_context(lock)
+
+            for user_id, requests in by_user.items():
+                try:
+                    placed[user_id] = self._place_envelopes(user_id, requests)
+                except Exception as e:
+                    # Ex: pasta do usuário inacessível; os pedidos restantes recebem None no GroupCommitter
+                    print(f"[!] Erro ao gravar envelopes de {user_id}: {e}")
+
+            if self.config.durable_commits:
+                try:
+                    sync_paths([str(path) for items in placed.values() for _, _, path in items])
+                except Exception as e:
+                    # Sem garantia de durabilidade não há confirmação: desfaz o lote inteiro
+                    print(f"[!] Erro ao sincronizar o lote em disco: {e}")
+                    for user_id, items in placed.items():
+                        self._rollback_envelopes(user_id, items)
+                    placed = {}
+
+            for user_id, items in list(placed.items()):
+                if not items:
+                    continue
+                try:
+                    # Delega a atualização do JSON de referência para o serviço (uma vez por usuário)
+                    self.service.update_references_batch(
+                        user_id, [(sequence, request.file_hash) for request, sequence, _ in items]
+                    )
+                except Exception as e:
+                    print(f"[!] Erro ao indexar envelopes de {user_id}: {e}")
+                    self._rollback_envelopes(user_id, items)
+                    del placed[user_id]
+                    continue
+                for request, sequence, _ in items:
+                    if request.manifest is not None:
+                        self.chunks.register(user_id, sequence, request.manifest)
+
+        for user_id, items in placed.items():
+            for request, sequence, _ in items:
+                request.future.set_result(sequence)
+                self._notify_commit(user_id, sequence, request.file_hash)
+
+    def _rollback_envelopes(self, user_id, items):
+        """Remove envelopes (e manifestos) gravados mas não confirmados e responde None aos pedidos."""
+        for request, sequence, file_path in items:
+            try:
+                file_path.unlink(missing_ok=True)
+                self.chunks.store(user_id, sequence, None)
+            except OSError as e:
+                print(f"[!] Não foi possível desfazer {file_path.name} de {user_id}: {e}")
+            request.future.set_result(None)
+
+    def _place_envelopes(self, user_id, requests):
+        """Move os temporários do usuário para os caminhos finais; retorna [(pedido, seq, caminho)].
+
+        Um envelope que não pôde ser gravado recebe None na hora e não impede os seguintes.
+        """
+        references = self.service.references
+        user_dir = self.storage.get_user_storage_path(user_id)
+        # Carrega o índice antes do rename: senão a recuperação de órfãos trataria o envelope como perdido
+        next_seq = references.get_sequence(user_id) + 1
+        taken = {}
+        placed = []
+
+        for request in requests:
+            sequence = request.sequence if request.sequence is not None else next_seq
+            filename = f"{str(sequence).zfill(4)}.dat.gz"
+
+            if sequence in taken or references.has(user_id, sequence):
+                existing = taken[sequence] if sequence in taken else references.get_hash(user_id, sequence)
+                Path(request.tmp_path).unlink(missing_ok=True)
+                if existing == request.file_hash:
+                    request.future.set_result(sequence)
+                else:
+                    print(f"[!] Conflito: {filename} de {user_id} já existe com outro conteúdo; mantendo o local")
+                    request.future.set_result(None)
+                continue
+
+            file_path = user_dir / filename
+            try:
+                # O manifesto vai antes do envelope: um envelope em chunks nunca fica sem ele
+                self.chunks.store(user_id, sequence, request.manifest)
+                os.replace(request.tmp_path, file_path)
+            except OSError as e:
+                print(f"[!] Erro ao gravar {filename} de {user_id}: {e}")
+                Path(request.tmp_path).unlink(missing_ok=True)
+                if request.manifest is not None:
+                    self.chunks.store(user_id, sequence, None)
+                request.future.set_result(None)
+                continue
+
+            # Conteúdo repetido passa a compartilhar o mesmo blob em disco
+            self.storage.blobs.adopt(file_path, request.file_hash)
+
+            taken[sequence] = request.file_hash
+            next_seq = max(next_seq, sequence + 1)
+            placed.append((request, sequence, file_path))
+        return placed
+
+    def link_envelope_from_blob(self, user_id, sequence, file_hash):
+        """Reaproveita um envelope já presente localmente (mesmo hash) sem baixá-lo de novo."""
+        if not file_hash:
+            return False
+        filename = f"{str(sequence).zfill(4)}.dat.gz"
+        file_path = self.storage.get_user_storage_path(user_id) / filename
+
+        with self.storage.user_lock(user_id):
+            if self.service.references.has(user_id, sequence):
+                return False
+            if not self.storage.blobs.link_into(file_hash, file_path):
+                return False
+            self.service.update_references(user_id, sequence, file_hash)
+
+        self._notify_commit(user_id, sequence, file_hash)
+        return True
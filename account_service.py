@@ -1,26 +1,29 @@
 import json
-from datetime import datetime
 from pathlib import Path
+from references_index import ReferencesIndex
 
 class AccountService:
     def __init__(self, storage_provider, config):
         self.storage = storage_provider
         self.config = config
         self.accounts_file = self.storage.base_system / "accounts.json"
+        # Backend de metadados (JSON ou SQLite) fornecido pelo StorageProvider
+        self.store = self.storage.metadata
+        # Índice em memória dos references.json (compartilhado com Manager e Server)
+        self.references = ReferencesIndex(storage_provider, config)
 
     def load_all_accounts(self) -> list:
         """Lê a base de contas ou cria a conta inicial baseada no .env."""
-        if not self.accounts_file.exists():
-            print("[*] Service: accounts.json não encontrado. Criando conta inicial...")
-            return self._create_initial_account()
-            
         try:
-            with open(self.accounts_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                return data if data else self._bootstrap_initial_account()
+            data = self.store.load_accounts()
         except (json.JSONDecodeError, Exception) as e:
-            print(f"[!] Erro ao ler accounts.json: {e}. Restaurando padrão...")
+            print(f"[!] Erro ao ler a base de contas: {e}. Restaurando padrão...")
             return self._bootstrap_initial_account()
+
+        if data is None:
+            print("[*] Service: base de contas não encontrada. Criando conta inicial...")
+            return self._create_initial_account()
+        return data if data else self._bootstrap_initial_account()
     
     def _bootstrap_initial_account(self) -> list:
         """Cria o registro inicial baseado nas variáveis do .env."""
@@ -55,34 +58,19 @@ class AccountService:
 
     def save_account(self, accounts_list: list):
         """Persiste a lista de contas atualizada."""
-        with open(self.accounts_file, "w", encoding="utf-8") as f:
-            json.dump(accounts_list, f, indent=4)
+        self.store.save_accounts(accounts_list)
 
-    def update_references(self, user_id, sequence, file_hash):
-        """Orquestra a atualização do mapa de arquivos (references.json)."""
-        ref_path = self.storage.get_user_storage_path(user_id) / "references.json"
-        
-        # Estrutura base caso o arquivo não exista
-        data = {"user": user_id, "sequence": 0, "files": [], "last_sync": ""}
-        
-        if ref_path.exists():
-            try:
-                with open(ref_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-            except:
-                pass
+    def add_accounts(self, new_accounts: list, accounts_list: list):
+        """Persiste um lote de contas novas (o backend decide se regrava ou apenas insere)."""
+        self.store.add_accounts(new_accounts, accounts_list)
 
-        # Atualiza dados de sincronização
-        data["sequence"] = max(data["sequence"], sequence)
-        data["last_sync"] = str(datetime.now())
-        
-        # Evita duplicar metadados do mesmo arquivo
-        if not any(f["seq"] == sequence for f in data["files"]):
-            data["files"].append({
-                "seq": sequence,
-                "hash": file_hash,
-                "ts": int(datetime.now().timestamp())
-            })
+    def update_references(self, user_id, sequence, file_hash):
+        """Orquestra a atualização do mapa de arquivos (references.json) via índice em memória."""
+        # Reentrante: o AccountManager já segura o lock do usuário durante o commit
+        with self.storage.user_lock(user_id):
+            self.references.add_file(user_id, sequence, file_hash)
 
-        with open(ref_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4)
\ No newline at end of file
+    def update_references_batch(self, user_id, items):
+        """Registra um lote [(seq, hash), ...] do usuário com uma única atualização do índice."""
+        with self.storage.user_lock(user_id):
+            self.references.add_files(user_id, items)
@@ -0,0 +1,68 @@
+import os
+from pathlib import Path
+
+
+class BlobStore:
+    """Armazenamento endereçado por conteúdo (SHA-256) dos envelopes.
+
+    Cada blob é um hardlink para os arquivos NNNN.dat.gz que têm o mesmo hash, então o
+    mesmo conteúdo ocupa o disco uma única vez, independente de usuário ou peer de origem.
+    """
+
+    def __init__(self, base_path):
+        self.base = Path(base_path)
+        self.base.mkdir(parents=True, exist_ok=True)
+
+    def blob_path(self, file_hash) -> Path:
+        return self.base / file_hash[:2] / file_hash
+
+    def has(self, file_hash) -> bool:
+        return bool(file_hash) and self.blob_path(file_hash).exists()
+
+    def adopt(self, file_path, file_hash):
+        """Registra um envelope recém-gravado; se o conteúdo já existia, passa a compartilhar o blob."""
+        if not file_hash:
+            return
+        blob = self.blob_path(file_hash)
+        try:
+            if blob.exists():
+                if not os.path.samefile(blob, file_path):
+                    self._link(blob, file_path)
+            else:
+                blob.parent.mkdir(exist_ok=True)
+                os.link(file_path, blob)
+        except FileExistsError:
+            # Outro envelope com o mesmo conteúdo registrou o blob ao mesmo tempo
+            pass
+        except OSError as e:
+            # Sistemas de arquivos sem hardlink: o envelope continua válido, só não é deduplicado
+            print(f"[!] BlobStore: deduplicação indisponível para {file_path.name}: {e}")
+
+    def link_into(self, file_hash, dest_path) -> bool:
+        """Materializa o blob no caminho do envelope sem transferir nada pela rede."""
+        if not self.has(file_hash):
+            return False
+        try:
+            self._link(self.blob_path(file_hash), dest_path)
+            return True
+        except OSError:
+            return False
+
+    def _link(self, blob, dest_path):
+        """Substitui `dest_path` por um hardlink do blob de forma atômica."""
+        tmp_path = dest_path.with_name(f"{dest_path.name}.link.tmp")
+        tmp_path.unlink(missing_ok=True)
+        os.link(blob, tmp_path)
+        os.replace(tmp_path, dest_path)
+
+    def cleanup_unreferenced(self) -> int:
+        """Remove blobs que não têm mais nenhum envelope apontando para eles."""
+        removed = 0
+        for blob in self.base.glob("*/*"):
+            try:
+                if blob.stat().st_nlink <= 1:
+                    blob.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
@@ -0,0 +1,86 @@
+import time
+import queue
+import random
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+
+class ChangeAnnouncer:
+    """Avisa os peers, logo após cada commit, que há um envelope novo (push em vez de esperar o polling)."""
+
+    def __init__(self, config, peer_mgr):
+        self.config = config
+        self.peer_mgr = peer_mgr
+        self.my_address = f"{config.node_host}:{config.node_port}"
+        self.running = False
+
+        self._queue = queue.Queue()
+        # Envios em paralelo: um peer lento ou fora do ar não atrasa o aviso aos demais
+        self._pool = ThreadPoolExecutor(max_workers=config.sync_workers, thread_name_prefix="announce")
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_maxsize=config.sync_workers))
+
+    def start(self):
+        self.running = True
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+        print("[*] Change Announcer ativo (push de novidades para os peers)")
+
+    def on_commit(self, user_id, sequence, file_hash):
+        """Listener do AccountManager: apenas enfileira, para não atrasar o commit."""
+        if self.running:
+            self._queue.put((user_id, sequence, file_hash))
+
+    def _run(self):
+        while self.running:
+            user_id, sequence, file_hash = self._queue.get()
+            if not self.running:
+                break
+
+            # Agrupa os commits da janela: por usuário basta anunciar a maior sequência
+            latest = {user_id: (sequence, file_hash)}
+            deadline = time.monotonic() + self.config.announce_delay
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    user_id, sequence, file_hash = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if sequence >= latest.get(user_id, (0, None))[0]:
+                    latest[user_id] = (sequence, file_hash)
+
+            # A rodada dura no máximo um timeout, não um timeout por peer
+            wait([
+                self._pool.submit(self._send, target, user_id, sequence, file_hash)
+                for user_id, (sequence, file_hash) in latest.items()
+                for target in self.get_announce_targets()
+            ])
+
+    def get_announce_targets(self):
+        """Peers que recebem os anúncios (no gossip, só um sorteio: quem recebe reanuncia).
+
+        Peers em backoff ficam de fora: quando voltarem, o polling traz as novidades.
+        """
+        targets = [
+            t for t in self.peer_mgr.get_all_targets()
+            if t != self.my_address and self.peer_mgr.is_healthy(t)
+        ]
+        if self.peer_mgr.gossip_enabled():
+            return random.sample(targets, min(self.config.gossip_fanout, len(targets)))
+        return targets
+
+    def _send(self, target, user_id, sequence, file_hash):
+        payload = {"user": user_id, "seq": sequence, "hash": file_hash, "from": self.my_address}
+        try:
+            self._session.post(f"http://{target}/announce", json=payload, timeout=2)
+        except Exception:
+            # Peer fora do ar: o polling de anti-entropia cobre a falha
+            pass
+
+    def stop(self):
+        self.running = False
+        self._queue.put((None, 0, None))
+        self._pool.shutdown(wait=False)
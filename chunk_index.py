@@ -0,0 +1,151 @@
+import os
+import json
+import hashlib
+import threading
+
+
+def manifest_name(sequence) -> str:
+    return f"{str(sequence).zfill(4)}.chunks.json"
+
+
+def read_range(file_path, offset, length, block_size=64 * 1024):
+    """Lê `length` bytes de um envelope a partir de `offset`, em blocos."""
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            if not block:
+                raise EOFError(f"{file_path.name} menor que o manifesto")
+            remaining -= len(block)
+            yield block
+
+
+class ManifestVerifier:
+    """Confere em trânsito se os bytes do envelope batem com o manifesto (hash e tamanho de cada membro)."""
+
+    def __init__(self, manifest):
+        self._chunks = manifest["chunks"]
+        self._index = 0
+        self._remaining = self._chunks[0][1] if self._chunks else 0
+        self._hasher = hashlib.sha256()
+        self._ok = True
+
+    def update(self, data):
+        view = memoryview(data)
+        while view and self._ok:
+            if self._index >= len(self._chunks):
+                # Mais bytes do que o manifesto descreve
+                self._ok = False
+                return
+            take = min(len(view), self._remaining)
+            self._hasher.update(view[:take])
+            view = view[take:]
+            self._remaining -= take
+            if self._remaining == 0:
+                if self._hasher.hexdigest() != self._chunks[self._index][0]:
+                    self._ok = False
+                    return
+                self._index += 1
+                self._hasher = hashlib.sha256()
+                if self._index < len(self._chunks):
+                    self._remaining = self._chunks[self._index][1]
+
+    def matches(self) -> bool:
+        return self._ok and self._index == len(self._chunks)
+
+
+class _UserChunks:
+    """Manifestos e localização dos chunks dos envelopes de um usuário."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.manifests = {}     # seq -> manifesto
+        self.locations = {}     # hash do chunk -> (seq, offset, tamanho)
+
+
+class ChunkIndex:
+    """Índice dos envelopes em chunks (gzip multi-membro) de cada usuário.
+
+    O manifesto de cada envelope fica em NNNN.chunks.json, na pasta do usuário ao lado
+    do references.json. O índice é montado na primeira consulta do usuário e mantém,
+    para cada chunk, um envelope local que o contém: é de lá que o servidor entrega o
+    chunk e de onde o cliente o reaproveita ao montar uma versão nova do arquivo.
+    """
+
+    def __init__(self, storage_provider, references):
+        self.storage = storage_provider
+        self.references = references
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def _get(self, user_id) -> _UserChunks:
+        with self._lock:
+            chunks = self._users.get(user_id)
+            if chunks is None:
+                chunks = _UserChunks(self.storage.get_user_storage_path(user_id))
+                self._users[user_id] = chunks
+                self._load(user_id, chunks)
+            return chunks
+
+    def _load(self, user_id, chunks):
+        """Lê os manifestos da pasta; só valem os que batem com o hash registrado nas referências."""
+        for path in chunks.folder.glob("*.chunks.json"):
+            try:
+                sequence = int(path.name.split(".", 1)[0])
+                manifest = json.loads(path.read_text(encoding="utf-8"))
+            except (ValueError, OSError) as e:
+                print(f"[!] ChunkIndex: manifesto inválido {path.name} de {user_id}: {e}")
+                continue
+            if manifest.get("hash") and manifest["hash"] == self.references.get_hash(user_id, sequence):
+                self._register(chunks, sequence, manifest)
+
+    def _register(self, chunks, sequence, manifest):
+        chunks.manifests[sequence] = manifest
+        offset = 0
+        for chunk_hash, length in manifest["chunks"]:
+            chunks.locations.setdefault(chunk_hash, (sequence, offset, length))
+            offset += length
+
+    # --- LEITURA ---
+
+    def sequences(self, user_id, since=0) -> list:
+        """Sequências após `since` que têm manifesto (anunciadas no /references)."""
+        chunks = self._get(user_id)
+        with self._lock:
+            return sorted(seq for seq in chunks.manifests if seq > since)
+
+    def get_manifest(self, user_id, sequence):
+        return self._get(user_id).manifests.get(sequence)
+
+    def locate(self, user_id, chunk_hash):
+        """(caminho do envelope, offset, tamanho) de um chunk presente localmente, ou None."""
+        chunks = self._get(user_id)
+        location = chunks.locations.get(chunk_hash)
+        if location is None:
+            return None
+        sequence, offset, length = location
+        return chunks.folder / f"{str(sequence).zfill(4)}.dat.gz", offset, length
+
+    # --- ESCRITA ---
+
+    def store(self, user_id, sequence, manifest):
+        """Grava o manifesto antes do envelope entrar no caminho final (chamado sob o lock do usuário).
+
+        Sem manifesto, remove um arquivo antigo da mesma sequência (ex: sobra de uma queda).
+        """
+        folder = self.storage.get_user_storage_path(user_id)
+        path = folder / manifest_name(sequence)
+        if manifest is None:
+            path.unlink(missing_ok=True)
+            return
+
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        tmp_path.write_text(json.dumps(manifest, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def register(self, user_id, sequence, manifest):
+        """Disponibiliza os chunks do envelope recém-commitado."""
+        chunks = self._get(user_id)
+        with self._lock:
+            self._register(chunks, sequence, manifest)
@@ -20,10 +20,102 @@ class Config:
         # --- REGRAS DE ARMAZENAMENTO ---
         # Define se usa o nome real do usuário ou Hash SHA-256 nas pastas
         self.use_plain_names = os.getenv("USE_PLAIN_USER_NAMES", "False").lower() == "true"
+        # Quantidade máxima de usuários com caminhos resolvidos mantidos em memória
+        self.path_cache_size = int(os.getenv("PATH_CACHE_SIZE", 100000))
+        # Locks por usuário (striping): usuários diferentes só disputam lock ao cair na mesma faixa
+        self.lock_stripes = int(os.getenv("LOCK_STRIPES", 1024))
         
+        # --- SERVIDOR HTTP ---
+        # production = Gunicorn (gthread + sendfile); development = servidor do Flask; auto = Gunicorn se instalado
+        self.server_mode = os.getenv("SERVER_MODE", "auto").lower()
+        # Threads de atendimento, segundos de keep-alive entre requisições e fila de conexões pendentes
+        self.server_threads = int(os.getenv("SERVER_THREADS", 32))
+        self.server_keepalive = int(os.getenv("SERVER_KEEPALIVE", 15))
+        self.server_backlog = int(os.getenv("SERVER_BACKLOG", 2048))
+        # Memória máxima do cache de respostas prontas (/accounts, /references) e tamanho
+        # mínimo do corpo para guardar também a versão gzip
+        self.response_cache_mb = int(os.getenv("RESPONSE_CACHE_MB", 64))
+        self.response_gzip_min_bytes = int(os.getenv("RESPONSE_GZIP_MIN_BYTES", 1024))
+
         # --- INTERVALOS DE TEMPO (EM SEGUNDOS) ---
         self.sync_interval = int(os.getenv("SYNC_INTERVAL", 30))
         self.gc_interval = int(os.getenv("GC_INTERVAL", 60))
+
+        # --- INBOUND ---
+        # auto = inotify no Linux com fallback para polling; inotify; poll
+        self.inbound_watch_mode = os.getenv("INBOUND_WATCH_MODE", "auto").lower()
+        # Intervalo para registrar pastas de contas novas, reconciliar eventos perdidos e retentar falhas de ingestão
+        self.inbound_rescan_interval = int(os.getenv("INBOUND_RESCAN_INTERVAL", 30))
+        # Processos de hash/compressão (0 = threads no próprio processo) e nível do gzip (1-9)
+        self.ingest_workers = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+        self.gzip_level = int(os.getenv("GZIP_LEVEL", 6))
+        # Bloco de leitura/compressão da ingestão: limita a memória por arquivo, qualquer que seja o tamanho
+        self.ingest_chunk_size = int(os.getenv("INGEST_CHUNK_SIZE", 1024 * 1024))
+        # Um arquivo só é ingerido depois de ficar esse tempo sem mudar de tamanho/mtime (cópia em andamento)
+        self.inbound_stable_seconds = float(os.getenv("INBOUND_STABLE_SECONDS", 1.0))
+
+        # --- COMMIT EM GRUPO ---
+        # Espera extra (ms) para juntar mais commits e tamanho máximo do lote; com 0 o lote é
+        # o que acumulou na fila enquanto o lote anterior era gravado (sem latência extra)
+        self.group_commit_window_ms = float(os.getenv("GROUP_COMMIT_WINDOW_MS", 0))
+        self.group_commit_max_batch = int(os.getenv("GROUP_COMMIT_MAX_BATCH", 256))
+        # True = sincroniza o disco (um syncfs/fsync por lote) antes de confirmar os commits
+        self.durable_commits = os.getenv("DURABLE_COMMITS", "False").lower() == "true"
+
+        # --- ENVELOPES EM CHUNKS ---
+        # True = arquivos grandes do inbound viram gzip multi-membro com fronteiras definidas pelo
+        # conteúdo e um manifesto; uma versão editada só transfere os chunks que mudaram.
+        # O corte em chunks custa CPU na ingestão (roda no pool de INGEST_WORKERS)
+        self.chunked_envelopes = os.getenv("CHUNKED_ENVELOPES", "False").lower() == "true"
+        # Tamanho mínimo do arquivo para usar o formato em chunks e tamanho médio do chunk (potência de 2)
+        self.chunked_min_file_size = int(os.getenv("CHUNKED_MIN_FILE_SIZE", 1024 * 1024))
+        self.chunk_avg_size = int(os.getenv("CHUNK_AVG_SIZE", 64 * 1024))
+
+        # --- METADADOS ---
+        # json = arquivos em data/system e por usuário; sqlite = data/system/metadata.db (WAL)
+        self.metadata_backend = os.getenv("METADATA_BACKEND", "json").lower()
+
+        # --- REFERENCES ---
+        # Janela de agrupamento das gravações do references.json e intervalo de checagem do mtime
+        self.references_flush_interval = float(os.getenv("REFERENCES_FLUSH_INTERVAL", 1.0))
+        self.references_recheck_interval = float(os.getenv("REFERENCES_RECHECK_INTERVAL", 2.0))
+        # Mínimo de entradas no references.log para compactar no references.json (o gatilho real
+        # é o maior entre esse valor e metade das entradas do snapshot)
+        self.references_compact_threshold = int(os.getenv("REFERENCES_COMPACT_THRESHOLD", 1000))
+
+        # --- SINCRONIZAÇÃO CONCORRENTE ---
+        # Limite global de requisições simultâneas, limite por peer e peers em paralelo
+        self.sync_workers = int(os.getenv("SYNC_WORKERS", 8))
+        self.sync_peer_workers = int(os.getenv("SYNC_PEER_WORKERS", 2))
+        self.sync_max_peers = int(os.getenv("SYNC_MAX_PEERS", 16))
+        # Peers com novidades recentes são consultados a cada SYNC_MIN_INTERVAL; peers que
+        # falham esperam em backoff exponencial a partir de SYNC_INTERVAL até SYNC_MAX_BACKOFF
+        self.sync_min_interval = float(os.getenv("SYNC_MIN_INTERVAL", 5))
+        self.sync_max_backoff = float(os.getenv("SYNC_MAX_BACKOFF", 600))
+        # Máximo de envelopes por requisição na transferência em lote (0 desativa)
+        self.bulk_max_records = int(os.getenv("BULK_MAX_RECORDS", 500))
+        # Download de vários peers ao mesmo tempo: máximo de fontes, envelopes por peça e
+        # segundos sem receber dados até considerar o peer parado e repassar a peça
+        self.swarm_max_sources = int(os.getenv("SWARM_MAX_SOURCES", 4))
+        self.swarm_piece_size = int(os.getenv("SWARM_PIECE_SIZE", 32))
+        self.swarm_stall_timeout = float(os.getenv("SWARM_STALL_TIMEOUT", 10))
+
+        # --- GOSSIP ---
+        # all = sincroniza com todos os peers; gossip = a cada rodada, GOSSIP_FANOUT peers sorteados
+        # da visão parcial; auto = gossip quando a visão tem mais peers que o fanout
+        self.sync_mode = os.getenv("SYNC_MODE", "auto").lower()
+        self.gossip_fanout = int(os.getenv("GOSSIP_FANOUT", 4))
+        # Tamanho máximo da visão parcial de peers e quantos endereços vão em cada troca (/peers)
+        self.peer_view_size = int(os.getenv("PEER_VIEW_SIZE", 64))
+        self.peer_exchange_size = int(os.getenv("PEER_EXCHANGE_SIZE", 8))
+        # Janela de agrupamento das gravações da lista de peers
+        self.peers_flush_interval = float(os.getenv("PEERS_FLUSH_INTERVAL", 5.0))
+
+        # --- ANÚNCIOS (PUSH) ---
+        # Avisa os peers a cada commit; o polling de SYNC_INTERVAL continua como anti-entropia
+        self.announce_enabled = os.getenv("ANNOUNCE_ENABLED", "True").lower() == "true"
+        # Janela para agrupar commits seguidos em um único anúncio por usuário
+        self.announce_delay = float(os.getenv("ANNOUNCE_DELAY", 0.2))
         
         # --- INITIAL ACCOUNT ---
         # Usuário inicial do sistema
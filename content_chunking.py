@@ -0,0 +1,84 @@
+import zlib
+import hashlib
+
+# Tabela do gear hash: 256 valores de 64 bits derivados do SHA-256 (iguais em todos os nós e reinícios)
+GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "big") for i in range(256)]
+_MASK64 = (1 << 64) - 1
+
+
+def _cut_mask(avg_size):
+    """Máscara nos bits altos do hash: um corte a cada ~avg_size bytes, dependente dos últimos 64 bytes."""
+    bits = max(avg_size.bit_length() - 1, 1)
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+def find_cut(buffer, min_size, max_size, mask):
+    """Posição do próximo corte em `buffer` (gear hash rolante, estilo FastCDC).
+
+    Os primeiros `min_size` bytes nunca são examinados como corte: como o hash só depende
+    dos últimos 64 bytes, basta aquecê-lo nessa janela antes do mínimo.
+    """
+    size = len(buffer)
+    if size <= min_size:
+        return size
+    end = min(size, max_size)
+    gear = GEAR
+
+    h = 0
+    for i in range(max(min_size - 64, 0), min_size):
+        h = ((h << 1) + gear[buffer[i]]) & _MASK64
+    for i in range(min_size, end):
+        h = ((h << 1) + gear[buffer[i]]) & _MASK64
+        if not h & mask:
+            return i + 1
+    return end
+
+
+def iter_chunks(stream, avg_size, read_size=1024 * 1024):
+    """Divide o fluxo em chunks de fronteira definida pelo conteúdo (entre avg/4 e avg*4 bytes).
+
+    Uma edição no meio do arquivo só altera os chunks ao redor dela: os cortes seguintes
+    voltam a cair nos mesmos pontos. A memória fica limitada a `read_size` + avg*4.
+    """
+    min_size, max_size = max(avg_size // 4, 64), avg_size * 4
+    mask = _cut_mask(avg_size)
+    buffer = bytearray()
+    eof = False
+
+    while True:
+        while not eof and len(buffer) < max_size:
+            block = stream.read(read_size)
+            if block:
+                buffer += block
+            else:
+                eof = True
+        if not buffer:
+            return
+
+        cut = find_cut(buffer, min_size, max_size, mask)
+        yield bytes(buffer[:cut])
+        del buffer[:cut]
+
+
+def compress_chunked(src_path, dst_path, level, avg_size, read_size=1024 * 1024):
+    """Comprime o arquivo como gzip multi-membro: um membro independente por chunk.
+
+    O resultado continua sendo um .dat.gz válido (descompacta para o arquivo original) e cada
+    membro pode ser transferido e reaproveitado isoladamente. Retorna o hash do envelope,
+    os tamanhos e a lista [[hash do membro, tamanho], ...] que compõe o manifesto.
+    """
+    hasher = hashlib.sha256()
+    raw_size = packed_size = 0
+    chunks = []
+
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        for chunk in iter_chunks(src, avg_size, read_size):
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+            member = compressor.compress(chunk) + compressor.flush()
+            hasher.update(member)
+            dst.write(member)
+            chunks.append([hashlib.sha256(member).hexdigest(), len(member)])
+            raw_size += len(chunk)
+            packed_size += len(member)
+
+    return hasher.hexdigest(), raw_size, packed_size, chunks
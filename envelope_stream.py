@@ -0,0 +1,100 @@
+import json
+import struct
+
+# Formato do fluxo em lote (framing por registro):
+#   [4 bytes: tamanho do cabeçalho][cabeçalho JSON {"seq", "hash", "size"}][size bytes do envelope]
+# Um cabeçalho de tamanho 0 marca o fim do fluxo. No fluxo de chunks, "seq" é a posição do
+# chunk no pedido e "hash" o SHA-256 do membro gzip.
+HEADER_LEN = struct.Struct(">I")
+CHUNK_SIZE = 64 * 1024
+END_OF_STREAM = HEADER_LEN.pack(0)
+# Um cabeçalho legítimo tem poucas dezenas de bytes; o limite impede que um peer faça o
+# leitor tentar bufferizar até 4 GiB com um prefixo de tamanho forjado
+MAX_HEADER_SIZE = 64 * 1024
+
+
+def encode_header(sequence, file_hash, size) -> bytes:
+    """Serializa o cabeçalho de um registro já com o prefixo de tamanho."""
+    header = json.dumps({"seq": sequence, "hash": file_hash, "size": size}).encode("utf-8")
+    return HEADER_LEN.pack(len(header)) + header
+
+
+def stream_envelope_files(entries):
+    """Gera o fluxo em lote a partir de (seq, hash, path), lendo cada arquivo em blocos."""
+    for sequence, file_hash, file_path in entries:
+        try:
+            size = file_path.stat().st_size
+        except FileNotFoundError:
+            continue
+
+        yield encode_header(sequence, file_hash, size)
+        with open(file_path, "rb") as f:
+            remaining = size
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    # O cabeçalho já prometeu `size` bytes: interrompe a resposta em vez de desalinhar o fluxo
+                    raise EOFError(f"{file_path.name} encolheu durante o envio")
+                remaining -= len(chunk)
+                yield chunk
+    yield END_OF_STREAM
+
+
+def stream_chunk_ranges(entries):
+    """Mesmo framing para chunks de envelopes: (posição no pedido, hash, path, offset, tamanho)."""
+    for index, chunk_hash, file_path, offset, length in entries:
+        try:
+            f = open(file_path, "rb")
+        except FileNotFoundError:
+            # O registro que falta encerra o fluxo: o cliente detecta a posição fora de ordem
+            break
+
+        yield encode_header(index, chunk_hash, length)
+        with f:
+            f.seek(offset)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    # O cabeçalho já prometeu `length` bytes: seguir desalinharia os registros.
+                    # Interrompe a resposta; o cliente vê o fluxo truncado e descarta a montagem
+                    raise EOFError(f"{file_path.name} menor que o chunk anunciado")
+                remaining -= len(chunk)
+                yield chunk
+    yield END_OF_STREAM
+
+
+def _iter_exact(stream, size):
+    """Produz exatamente `size` bytes do fluxo em blocos de até CHUNK_SIZE."""
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            raise EOFError("Fluxo em lote truncado")
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _read_exact(stream, size) -> bytes:
+    """Lê exatamente `size` bytes do fluxo ou falha se a conexão terminar antes."""
+    return b"".join(_iter_exact(stream, size))
+
+
+def iter_envelope_records(stream):
+    """Consome o fluxo em lote e produz (cabeçalho, blocos) para cada registro recebido.
+
+    Os blocos de um registro devem ser consumidos antes de avançar; o que sobrar é descartado.
+    """
+    while True:
+        (header_len,) = HEADER_LEN.unpack(_read_exact(stream, HEADER_LEN.size))
+        if header_len == 0:
+            return
+        if header_len > MAX_HEADER_SIZE:
+            raise ValueError(f"Cabeçalho de {header_len} bytes excede o limite do fluxo em lote")
+        header = json.loads(_read_exact(stream, header_len).decode("utf-8"))
+
+        body = _iter_exact(stream, header["size"])
+        yield header, body
+        # Garante o alinhamento do próximo registro mesmo se o consumidor parou no meio
+        for _ in body:
+            pass
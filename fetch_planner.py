@@ -0,0 +1,66 @@
+import threading
+from collections import deque
+from references_index import subtract_runs
+
+
+class FetchPlanner:
+    """Divide as sequências faltantes em peças e as entrega aos peers que as anunciam.
+
+    Modelo pull: cada peer pede a próxima peça assim que termina a anterior, então quem
+    tem mais vazão leva mais peças. Peças que falham ou chegam incompletas voltam para
+    a fila e podem ser assumidas por outro peer.
+    """
+
+    def __init__(self, sequences, piece_size):
+        self.pending = deque()
+        for start, end in _to_pieces(sequences, piece_size):
+            self.pending.append((start, end))
+
+        self.in_flight = 0
+        self.completed = 0
+        # Peça -> peers que já falharam nela (não a recebem de novo)
+        self._failed = {}
+        self._cond = threading.Condition()
+
+    def next_piece(self, peer, held):
+        """Próxima peça que o peer tem por inteiro; None quando não há mais nada para ele.
+
+        Bloqueia enquanto houver peças com outros peers que ainda podem voltar para a fila.
+        """
+        with self._cond:
+            while True:
+                for piece in self.pending:
+                    if peer not in self._failed.get(piece, ()) and not subtract_runs([list(piece)], held):
+                        self.pending.remove(piece)
+                        self.in_flight += 1
+                        return piece
+                if self.in_flight == 0:
+                    return None
+                self._cond.wait(timeout=1.0)
+
+    def complete(self, piece, failed, peer):
+        """Fecha a peça; as sequências que não chegaram (`failed`) voltam para a fila em faixas."""
+        start, end = piece
+        with self._cond:
+            self.in_flight -= 1
+            self.completed += (end - start + 1) - len(failed)
+            for remainder in reversed(_to_pieces(failed, end - start + 1)):
+                self._failed.setdefault(remainder, set()).update(self._failed.get(piece, ()))
+                self._failed[remainder].add(peer)
+                self.pending.appendleft(remainder)
+            self._cond.notify_all()
+
+    def remaining(self):
+        with self._cond:
+            return sum(end - start + 1 for start, end in self.pending)
+
+
+def _to_pieces(sequences, piece_size):
+    """Faixas contíguas de `sequences` (ordenadas), cortadas em peças de até `piece_size`."""
+    pieces = []
+    for seq in sequences:
+        if pieces and seq == pieces[-1][1] + 1 and pieces[-1][1] - pieces[-1][0] + 1 < piece_size:
+            pieces[-1][1] = seq
+        else:
+            pieces.append([seq, seq])
+    return [tuple(piece) for piece in pieces]
@@ -23,6 +23,8 @@ class GarbageCollector:
             try:
                 self.cleanup_orphan_folders()
                 self.cleanup_old_inbound_files()
+                self.cleanup_stale_temp_files()
+                self.cleanup_unreferenced_blobs()
             except Exception as e:
                 print(f"[!] Erro no Garbage Collector: {e}")
             
@@ -35,18 +37,26 @@ class GarbageCollector:
             return
 
         # Mapeia quais são os nomes de pasta válidos hoje (Hash ou Real)
-        valid_folder_names = [
-            self.storage_ptr.get_user_folder_name(acc['user']) 
-            for acc in self.account_mgr.accounts
-        ]
+        valid_folder_names = self._valid_folder_names()
 
         for folder in base_storage.iterdir():
             if folder.is_dir() and folder.name not in valid_folder_names:
-                print(f"[*] GC: Removendo pasta órfã: {folder.name}")
-                try:
-                    shutil.rmtree(folder)
-                except Exception as e:
-                    print(f"[!] GC: Erro ao remover {folder.name}: {e}")
+                # Mesmo lock do commit/provisionamento: a conta pode ter chegado nesse meio tempo
+                with self.storage_ptr.folder_lock(folder.name):
+                    if folder.name in self._valid_folder_names():
+                        continue
+                    print(f"[*] GC: Removendo pasta órfã: {folder.name}")
+                    try:
+                        shutil.rmtree(folder)
+                        self.storage_ptr.forget_folder(folder.name)
+                    except Exception as e:
+                        print(f"[!] GC: Erro ao remover {folder.name}: {e}")
+
+    def _valid_folder_names(self):
+        return {
+            self.storage_ptr.get_user_folder_name(acc['user'])
+            for acc in list(self.account_mgr.accounts)
+        }
 
     def cleanup_old_inbound_files(self):
         """Limpa arquivos que ficaram 'presos' no inbound por mais de 24h."""
@@ -64,5 +74,34 @@ class GarbageCollector:
                         print(f"[*] GC: Removendo arquivo antigo no inbound: {file.name}")
                         file.unlink()
 
+    def cleanup_stale_temp_files(self):
+        """Remove temporários e downloads parciais (.part) abandonados há mais de 24h."""
+        base_storage = self.storage_ptr.base_storage
+        if not base_storage.exists():
+            return
+
+        threshold = (datetime.now() - timedelta(hours=24)).timestamp()
+
+        stale_candidates = list(base_storage.glob("*/*.tmp")) + list(base_storage.glob("*/*.part"))
+        for tmp_file in stale_candidates:
+            lock = self.storage_ptr.folder_lock(tmp_file.parent.name)
+            # Pasta com commit em andamento: fica para a próxima passada
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                if tmp_file.stat().st_mtime < threshold:
+                    print(f"[*] GC: Removendo temporário abandonado: {tmp_file.name}")
+                    tmp_file.unlink()
+            except FileNotFoundError:
+                pass
+            finally:
+                lock.release()
+
+    def cleanup_unreferenced_blobs(self):
+        """Remove do armazenamento por conteúdo os blobs que nenhum envelope usa mais."""
+        removed = self.storage_ptr.blobs.cleanup_unreferenced()
+        if removed:
+            print(f"[*] GC: {removed} blob(s) sem referência removido(s)")
+
     def stop(self):
         self.running = False
\ No newline at end of file
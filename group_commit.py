@@ -0,0 +1,108 @@
+import os
+import time
+import queue
+import ctypes
+import threading
+from concurrent.futures import Future
+
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _syncfs = _libc.syncfs
+except (OSError, AttributeError):
+    # Fora do Linux não há syncfs: cai no fsync arquivo a arquivo
+    _syncfs = None
+
+
+def sync_paths(paths):
+    """Garante em disco os arquivos e renames do lote com uma única chamada (syncfs) quando possível."""
+    if not paths:
+        return
+    if _syncfs is not None:
+        fd = os.open(os.path.dirname(os.path.abspath(paths[0])), os.O_RDONLY)
+        try:
+            if _syncfs(fd) == 0:
+                return
+        finally:
+            os.close(fd)
+
+    folders = set()
+    for path in paths:
+        with open(path, "rb") as f:
+            os.fsync(f.fileno())
+        folders.add(os.path.dirname(os.path.abspath(path)))
+    if os.name == "posix":
+        for folder in folders:
+            fd = os.open(folder, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+
+class CommitRequest:
+    """Um envelope já validado aguardando o commit; `sequence=None` aloca a próxima do usuário.
+
+    `manifest` acompanha os envelopes em chunks e é gravado junto com o envelope.
+    """
+
+    __slots__ = ("user_id", "tmp_path", "sequence", "file_hash", "manifest", "future")
+
+    def __init__(self, user_id, tmp_path, sequence, file_hash, manifest=None):
+        self.user_id = user_id
+        self.tmp_path = tmp_path
+        self.sequence = sequence
+        self.file_hash = file_hash
+        self.manifest = manifest
+        self.future = Future()
+
+
+class GroupCommitter:
+    """Agrupa os commits de envelopes que chegam juntos (ingestão em rajada, catch-up de peers).
+
+    Uma thread junta os pedidos por até GROUP_COMMIT_WINDOW_MS ou GROUP_COMMIT_MAX_BATCH
+    itens e os entrega de uma vez ao AccountManager: um lock por usuário, uma atualização
+    do índice por usuário e, com DURABLE_COMMITS, um único sync por lote.
+    Cada pedido recebe um Future com a sequência gravada (ou None se foi recusado).
+    """
+
+    def __init__(self, config, commit_batch):
+        self.config = config
+        self._commit_batch = commit_batch
+        self._queue = queue.Queue()
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id, tmp_path, sequence, file_hash, manifest=None) -> Future:
+        request = CommitRequest(user_id, tmp_path, sequence, file_hash, manifest)
+        self._queue.put(request)
+        return request.future
+
+    def _run(self):
+        window = self.config.group_commit_window_ms / 1000
+        while self.running:
+            batch = [self._queue.get()]
+            # Junta o que chegar enquanto os produtores continuam enviando
+            deadline = time.monotonic() + window
+            while len(batch) < self.config.group_commit_max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._commit_batch(batch)
+            except Exception as e:
+                print(f"[!] Erro no commit em grupo: {e}")
+            finally:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_result(None)
+                        try:
+                            os.unlink(request.tmp_path)
+                        except FileNotFoundError:
+                            pass
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,78 @@
+import os
+import sys
+import ctypes
+import ctypes.util
+import select
+import struct
+
+# Constantes do inotify (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o0004000
+IN_CLOEXEC = 0o2000000
+
+# struct inotify_event { int wd; uint32 mask; uint32 cookie; uint32 len; char name[]; }
+_EVENT = struct.Struct("iIII")
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        # Valida a existência do símbolo antes de oferecer o backend
+        getattr(libc, "inotify_init1")
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class InotifyWatcher:
+    """Backend de eventos do kernel Linux para as pastas inbound (sem dependências externas)."""
+
+    def __init__(self):
+        self._libc = _load_libc()
+        if self._libc is None:
+            raise OSError("inotify não disponível nesta plataforma")
+
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "Falha em inotify_init1")
+
+        self._poller = select.poll()
+        self._poller.register(self.fd, select.POLLIN)
+
+    def add_watch(self, path, mask=IN_CLOSE_WRITE | IN_MOVED_TO) -> int:
+        """Passa a observar a pasta; reage apenas a arquivos fechados após escrita ou movidos para ela."""
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(str(path)), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"Falha ao observar {path}")
+        return wd
+
+    def read_events(self, timeout=1.0) -> list:
+        """Aguarda até `timeout` segundos e retorna os eventos pendentes como (wd, mask, nome)."""
+        if not self._poller.poll(int(timeout * 1000)):
+            return []
+
+        events = []
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return events
+
+        offset = 0
+        while offset + _EVENT.size <= len(buffer):
+            wd, mask, _cookie, name_len = _EVENT.unpack_from(buffer, offset)
+            offset += _EVENT.size
+            name = buffer[offset:offset + name_len].rstrip(b"\0").decode("utf-8", "surrogateescape")
+            offset += name_len
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
@@ -1,25 +1,55 @@
 import time
 import threading
-import hashlib
 from pathlib import Path
+from inbound_inotify import InotifyWatcher, IN_IGNORED, IN_Q_OVERFLOW
+from ingest_pipeline import IngestPipeline
 
 class InboundWatcher:
     def __init__(self, config, account_mgr):
         self.config = config
         self.account_mgr = account_mgr
         # O Watcher agora usa o provider que está dentro do manager
-        self.storage_ptr = account_mgr.storage 
+        self.storage_ptr = account_mgr.storage
         self.running = False
 
+        # Estágios de hash/compressão e commit ficam no pipeline
+        self.pipeline = IngestPipeline(config, account_mgr)
+
+        # Backend de eventos (inotify) e mapa watch descriptor -> (usuário, pasta)
+        self._inotify = None
+        self._watches = {}
+        self._watched_users = set()
+        # Pastas que o kernel recusou observar (ex: ENOSPC em max_user_watches): ficam no polling
+        self._unwatched = {}
+
+        # Arquivos vistos mas ainda possivelmente em cópia: caminho -> [usuário, (tamanho, mtime), visto_em]
+        self._candidates = {}
+
     def start(self):
         """Inicia o monitoramento da pasta inbound."""
         self.running = True
         # Garante que as pastas de entrada de todos os usuários existam
         self.sync_inbound_structure()
-        
-        thread = threading.Thread(target=self._run, daemon=True)
+
+        self._inotify = self._create_inotify()
+        target = self._run_inotify if self._inotify else self._run
+
+        thread = threading.Thread(target=target, daemon=True)
         thread.start()
-        print(f"[*] Inbound Watcher: Vigilância ativa via StorageProvider.")
+        mode = "eventos inotify" if self._inotify else "polling"
+        print(f"[*] Inbound Watcher: Vigilância ativa via StorageProvider ({mode}).")
+
+    def _create_inotify(self):
+        """Escolhe o backend conforme INBOUND_WATCH_MODE; cai para polling se o inotify falhar."""
+        mode = getattr(self.config, 'inbound_watch_mode', "auto")
+        if mode == "poll":
+            return None
+        try:
+            return InotifyWatcher()
+        except OSError as e:
+            if mode == "inotify":
+                print(f"[!] Watcher: inotify indisponível ({e}). Usando polling.")
+            return None
 
     def sync_inbound_structure(self):
         """Usa o provider para garantir que as pastas inbound (Hash/Real) existam."""
@@ -35,41 +65,146 @@ class InboundWatcher:
                 print(f"[!] Erro no loop do Watcher: {e}")
             time.sleep(2)
 
+    def _run_inotify(self):
+        """Loop orientado a eventos: dorme no kernel até um arquivo ser fechado ou movido para o inbound."""
+        next_rescan = 0
+        next_poll = 0
+        while self.running:
+            try:
+                # Registra pastas de contas novas (ex: descobertas via sync) e varre todas as pastas:
+                # pega o que já estava lá antes do watch e retenta arquivos cuja ingestão falhou
+                # (eles continuam no inbound, mas não geram evento novo)
+                if time.monotonic() >= next_rescan:
+                    # Avança antes: uma falha na varredura não pode repetir a varredura a cada volta
+                    next_rescan = time.monotonic() + self.config.inbound_rescan_interval
+                    self._watch_new_accounts()
+                    self._check_for_new_files()
+                elif self._unwatched and time.monotonic() >= next_poll:
+                    # Pastas sem watch são varridas no ritmo do modo polling
+                    next_poll = time.monotonic() + 2
+                    self._ingest([
+                        item for user_id, inbound_path in list(self._unwatched.items())
+                        for item in self._discover(user_id, inbound_path)
+                    ])
+
+                # Com arquivos aguardando estabilizar, acorda mais cedo para conferi-los
+                events = self._inotify.read_events(timeout=0.25 if self._candidates else 1.0)
+                # Em rajadas, agrupa os eventos que chegam em seguida num único lote do pipeline
+                while events and len(events) < 1024:
+                    more = self._inotify.read_events(timeout=0.05)
+                    if not more:
+                        break
+                    events.extend(more)
+
+                batch = []
+                seen = set()
+                for wd, mask, name in events:
+                    if mask & IN_Q_OVERFLOW:
+                        # Fila do kernel estourou: reconcilia com uma varredura completa
+                        self._check_for_new_files()
+                        continue
+
+                    watch = self._watches.get(wd)
+                    if watch is None:
+                        continue
+                    user_id, inbound_path = watch
+
+                    if mask & IN_IGNORED:
+                        # A pasta foi removida; será registrada de novo na próxima reconciliação
+                        del self._watches[wd]
+                        self._watched_users.discard(user_id)
+                        continue
+
+                    file_path = inbound_path / name
+                    if name and file_path not in seen and file_path.is_file():
+                        seen.add(file_path)
+                        batch.append((user_id, file_path))
+
+                # IN_CLOSE_WRITE/IN_MOVED_TO: o arquivo já foi fechado ou chegou inteiro, não espera a janela
+                self._ingest(batch, settled=True)
+            except Exception as e:
+                print(f"[!] Erro no loop do Watcher: {e}")
+                time.sleep(1)
+
+        self._inotify.close()
+
+    def _watch_new_accounts(self):
+        """Adiciona watches apenas para contas ainda não observadas (a varredura seguinte pega o que já havia)."""
+        for acc in self.account_mgr.accounts:
+            user_id = acc['user']
+            if user_id in self._watched_users:
+                continue
+
+            inbound_path = self.storage_ptr.get_user_inbound_path(user_id)
+            try:
+                wd = self._inotify.add_watch(inbound_path)
+            except OSError as e:
+                # Uma pasta recusada não derruba as demais; nova tentativa na próxima reconciliação
+                if user_id not in self._unwatched:
+                    print(f"[!] Watcher: sem inotify para o inbound de {user_id} ({e}); usando polling")
+                self._unwatched[user_id] = inbound_path
+                continue
+            self._unwatched.pop(user_id, None)
+            self._watches[wd] = (user_id, inbound_path)
+            self._watched_users.add(user_id)
+
     def _check_for_new_files(self):
         """Varre apenas as pastas inbound que pertencem a usuários conhecidos."""
+        batch = []
         for acc in self.account_mgr.accounts:
             user_id = acc['user']
             inbound_path = self.storage_ptr.get_user_inbound_path(user_id)
+            batch.extend(self._discover(user_id, inbound_path))
+        self._ingest(batch)
 
-            for file in inbound_path.glob("*"):
-                if file.is_file():
-                    self._process_file(user_id, file)
+    def _discover(self, user_id, inbound_path):
+        """Estágio 1: lista os arquivos na pasta inbound do usuário (a estabilidade é conferida no _ingest)."""
+        return [(user_id, file) for file in sorted(inbound_path.glob("*")) if file.is_file()]
 
-    def _process_file(self, user_id, file_path):
-        """Lê o arquivo e solicita ao Manager que salve no storage oficial."""
-        print(f"[*] Watcher: Novo arquivo detectado para {user_id}: {file_path.name}")
-        
-        try:
-            with open(file_path, "rb") as f:
-                data_bytes = f.read()
-
-            file_hash = hashlib.sha256(data_bytes).hexdigest()
-            current_seq = self.account_mgr.get_local_sequence(user_id) + 1
-            
-            # O Manager cuida de salvar e atualizar o references.json
-            success = self.account_mgr.save_remote_envelope(
-                user_id=user_id,
-                data_bytes=data_bytes,
-                sequence=current_seq,
-                file_hash=file_hash
-            )
-
-            if success:
-                file_path.unlink() # Remove do inbound após sucesso
-                print(f"[V] Watcher: Arquivo processado e movido para storage.")
-            
-        except Exception as e:
-            print(f"[!] Watcher: Erro ao processar {file_path.name}: {e}")
+    def _take_stable(self, batch):
+        """Separa os arquivos que já terminaram de ser copiados; os demais são reavaliados depois.
+
+        Um arquivo está pronto quando o mtime já tem INBOUND_STABLE_SECONDS ou quando tamanho e
+        mtime não mudaram entre duas observações separadas por esse intervalo.
+        """
+        stable_seconds = self.config.inbound_stable_seconds
+        for user_id, file_path in batch:
+            self._candidates.setdefault(file_path, [user_id, None, 0.0])
+
+        now = time.time()
+        ready = []
+        for file_path, candidate in list(self._candidates.items()):
+            try:
+                st = file_path.stat()
+            except FileNotFoundError:
+                del self._candidates[file_path]
+                continue
+
+            signature = (st.st_size, st.st_mtime_ns)
+            if now - st.st_mtime >= stable_seconds or (candidate[1] == signature and now - candidate[2] >= stable_seconds):
+                ready.append((candidate[0], file_path))
+                del self._candidates[file_path]
+            elif candidate[1] != signature:
+                candidate[1], candidate[2] = signature, now
+        return ready
+
+    def _ingest(self, batch, settled=False):
+        """Entrega ao pipeline os arquivos estáveis (hash/compressão em paralelo, commit em ordem).
+
+        Com `settled`, o lote veio de eventos de fechamento/movimentação e segue direto; os
+        arquivos achados por varredura passam pela janela de estabilidade.
+        """
+        if settled:
+            for _, file_path in batch:
+                self._candidates.pop(file_path, None)
+            batch = batch + self._take_stable([])
+        else:
+            batch = self._take_stable(batch)
+        if not batch:
+            return
+        print(f"[*] Watcher: {len(batch)} arquivo(s) novo(s) detectado(s) no inbound")
+        self.pipeline.ingest(batch)
 
     def stop(self):
-        self.running = False
\ No newline at end of file
+        self.running = False
+        self.pipeline.shutdown()
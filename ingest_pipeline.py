@@ -0,0 +1,196 @@
+import os
+import zlib
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pathlib import Path
+from content_chunking import compress_chunked
+
+
+def compress_envelope(src_path, dst_path, level, chunk_size=1024 * 1024):
+    """Etapa executada nos processos: comprime o arquivo do inbound e calcula o SHA-256 do envelope.
+
+    O arquivo é lido, comprimido, hasheado e gravado em blocos de `chunk_size`: a memória
+    não depende do tamanho do arquivo. O gzip (wbits=31, mtime=0, sem nome de arquivo) tem
+    os mesmos bytes do gzip.compress(..., mtime=0), então o mesmo conteúdo gera sempre o mesmo hash.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    hasher = hashlib.sha256()
+    raw_size = packed_size = 0
+
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        for block in iter(lambda: src.read(chunk_size), b""):
+            raw_size += len(block)
+            packed = compressor.compress(block)
+            if packed:
+                hasher.update(packed)
+                dst.write(packed)
+                packed_size += len(packed)
+
+        packed = compressor.flush()
+        hasher.update(packed)
+        dst.write(packed)
+        packed_size += len(packed)
+
+    return hasher.hexdigest(), raw_size, packed_size
+
+
+class _StagedFile:
+    """Arquivo do inbound em compressão, aguardando a vez de ser commitado."""
+
+    __slots__ = ("user_id", "file_path", "tmp_path", "job")
+
+    def __init__(self, user_id, file_path, tmp_path, job):
+        self.user_id = user_id
+        self.file_path = file_path
+        self.tmp_path = tmp_path
+        self.job = job
+
+
+class IngestPipeline:
+    """Pipeline de ingestão em estágios: descoberta -> hash/compressão em paralelo -> commit em ordem.
+
+    `ingest` só enfileira: uma thread própria commita cada arquivo assim que a compressão
+    termina, na ordem de chegada dentro de cada usuário. Um arquivo grande atrasa apenas
+    os arquivos seguintes do mesmo usuário, nunca os de outros usuários nem o Watcher.
+    """
+
+    def __init__(self, config, account_mgr):
+        self.config = config
+        self.account_mgr = account_mgr
+        self.storage_ptr = account_mgr.storage
+        self._pool = None
+
+        # usuário -> fila de _StagedFile, e arquivos do inbound já em andamento
+        self._queues = {}
+        self._in_progress = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self.running = True
+        self._thread = threading.Thread(target=self._commit_loop, daemon=True)
+        self._thread.start()
+
+    def _get_pool(self):
+        """Cria o pool sob demanda: processos (spawn evita herdar threads e locks do nó) ou,
+        com INGEST_WORKERS=0, threads no próprio processo.
+
+        Nunca se comprime na thread de commit: um arquivo grande travaria os commits de todos.
+        """
+        if self._pool is None:
+            if self.config.ingest_workers > 0:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.config.ingest_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                # zlib e hashlib liberam o GIL em blocos grandes: as threads também andam em paralelo
+                self._pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="ingest")
+        return self._pool
+
+    def ingest(self, batch):
+        """Enfileira uma lista de (user_id, file_path) na ordem em que foram descobertos."""
+        if not batch:
+            return
+
+        pool = self._get_pool()
+        level = self.config.gzip_level
+        chunk_size = self.config.ingest_chunk_size
+
+        # Estágio 2: hash + compressão em streaming, distribuídos entre os núcleos
+        for user_id, file_path in batch:
+            with self._lock:
+                # Arquivo já em andamento (ex: redescoberto por uma varredura)
+                if file_path in self._in_progress:
+                    continue
+                self._in_progress.add(file_path)
+
+            # O arquivo pode ter sido consumido por uma varredura concorrente
+            try:
+                size = file_path.stat().st_size
+            except FileNotFoundError:
+                self._finish(file_path)
+                continue
+            user_dir = self.storage_ptr.get_user_storage_path(user_id)
+            fd, tmp_name = tempfile.mkstemp(dir=user_dir, prefix="ingest.", suffix=".tmp")
+            os.close(fd)
+
+            # Arquivos grandes podem virar envelopes em chunks (só os chunks alterados trafegam entre versões)
+            if self.config.chunked_envelopes and size >= self.config.chunked_min_file_size:
+                task = (compress_chunked, str(file_path), tmp_name, level, self.config.chunk_avg_size, chunk_size)
+            else:
+                task = (compress_envelope, str(file_path), tmp_name, level, chunk_size)
+
+            job = pool.submit(*task)
+            with self._lock:
+                self._queues.setdefault(user_id, deque()).append(
+                    _StagedFile(user_id, file_path, Path(tmp_name), job)
+                )
+        self._wakeup.set()
+
+    def _commit_loop(self):
+        """Estágio 3: commita a cabeça da fila de cada usuário assim que a compressão dela termina."""
+        while self.running:
+            ready = []
+            waiting = []
+            with self._lock:
+                for user_id in list(self._queues):
+                    queue = self._queues[user_id]
+                    while queue and queue[0].job.done():
+                        ready.append(queue.popleft())
+                    if queue:
+                        waiting.append(queue[0].job)
+                    else:
+                        del self._queues[user_id]
+
+            for staged in ready:
+                self._submit(staged)
+
+            if ready:
+                continue
+            if waiting:
+                wait(waiting, timeout=0.5, return_when=FIRST_COMPLETED)
+            else:
+                self._wakeup.wait(timeout=1.0)
+                self._wakeup.clear()
+
+    def _submit(self, staged):
+        """Envia ao commit em grupo (a sequência é alocada lá, sob o lock do usuário)."""
+        try:
+            result = staged.job.result()
+            file_hash, raw_size, packed_size = result[:3]
+            # compress_chunked devolve também a lista de chunks que forma o manifesto
+            manifest = {"hash": file_hash, "chunks": result[3]} if len(result) > 3 else None
+            future = self.account_mgr.submit_new_envelope(staged.user_id, staged.tmp_path, file_hash, manifest)
+        except Exception as e:
+            print(f"[!] Watcher: Erro ao processar {staged.file_path.name}: {e}")
+            staged.tmp_path.unlink(missing_ok=True)
+            self._finish(staged.file_path)
+            return
+
+        def on_commit(future):
+            try:
+                current_seq = future.result()
+                if current_seq is not None:
+                    staged.file_path.unlink() # Remove do inbound após sucesso
+                    print(f"[V] Watcher: {staged.file_path.name} -> seq {current_seq} ({raw_size} -> {packed_size} bytes)")
+            except Exception as e:
+                print(f"[!] Watcher: Erro ao processar {staged.file_path.name}: {e}")
+            finally:
+                staged.tmp_path.unlink(missing_ok=True)
+                self._finish(staged.file_path)
+
+        future.add_done_callback(on_commit)
+
+    def _finish(self, file_path):
+        with self._lock:
+            self._in_progress.discard(file_path)
+
+    def shutdown(self):
+        self.running = False
+        self._wakeup.set()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
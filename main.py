@@ -18,6 +18,8 @@ from network_server import NetworkServer
 from network_client import NetworkClient
 from garbage_collector import GarbageCollector
 from inbound_watcher import InboundWatcher
+from change_announcer import ChangeAnnouncer
+import production_server
 
 def main():
     print("="*50)
@@ -27,37 +29,13 @@ def main():
     try:
         # 1. Instância de Configuração (Base de tudo)
         config = Config()
-        
-        # 2. Instâncias de Infraestrutura (Camada de Baixo)
-        # O StorageProvider cuida do disco, o Service cuida das regras
-        storage_ptr = StorageProvider(config)
-        account_svc = AccountService(storage_ptr, config)
-
-        # 3. Instâncias de Gerenciamento (Camada Intermediária)
-        # Agora injetamos o Provider e o Service dentro do Manager
-        account_mgr = AccountManager(config, storage_ptr, account_svc)
-        peer_mgr = PeerManager(config)
-        start_peer_gc(peer_mgr)
-        node_mgr = NodeManager(config)
-
-        # 4. Serviços de Background
-        watcher = InboundWatcher(config, account_mgr)
-        watcher.start()
-
-        gc = GarbageCollector(config, account_mgr)
-        gc.start()
-
-        # 5. Cliente de Sincronização
-        client = NetworkClient(config, account_mgr, peer_mgr)
-        client.start_sync_loop()
-
-        # 6. Servidor (Loop Principal)
-        server = NetworkServer(config, account_mgr, peer_mgr, node_mgr)
-        
-        node_mgr.set_status("READY")
-        print(f"[*] Nó {config.node_id} operando em http://{config.node_host}:{config.node_port}")
-        
-        server.start()
+
+        if use_production_server(config):
+            # O Gunicorn monta o nó dentro do worker (threads não sobrevivem ao fork)
+            production_server.run(config, lambda: build_node(config))
+        else:
+            server = build_node(config)
+            server.start()
 
     except KeyboardInterrupt:
         print("\n[!] Sistema encerrado pelo usuário.")
@@ -68,6 +46,54 @@ def main():
         traceback.print_exc()
         sys.exit(1)
 
+def build_node(config):
+    """Monta as camadas do nó, inicia os serviços de background e retorna o NetworkServer."""
+    # 2. Instâncias de Infraestrutura (Camada de Baixo)
+    # O StorageProvider cuida do disco, o Service cuida das regras
+    storage_ptr = StorageProvider(config)
+    account_svc = AccountService(storage_ptr, config)
+
+    # 3. Instâncias de Gerenciamento (Camada Intermediária)
+    # Agora injetamos o Provider e o Service dentro do Manager
+    account_mgr = AccountManager(config, storage_ptr, account_svc)
+    peer_mgr = PeerManager(config, store=storage_ptr.metadata)
+    start_peer_gc(peer_mgr)
+    node_mgr = NodeManager(config)
+
+    # 4. Serviços de Background
+    watcher = InboundWatcher(config, account_mgr)
+    watcher.start()
+
+    gc = GarbageCollector(config, account_mgr)
+    gc.start()
+
+    # 5. Cliente de Sincronização
+    client = NetworkClient(config, account_mgr, peer_mgr)
+    client.start_sync_loop()
+
+    # Avisa os peers a cada envelope gravado (push); o ciclo acima segue como anti-entropia
+    if config.announce_enabled:
+        announcer = ChangeAnnouncer(config, peer_mgr)
+        account_mgr.add_commit_listener(announcer.on_commit)
+        announcer.start()
+
+    # 6. Servidor (Loop Principal)
+    server = NetworkServer(config, account_mgr, peer_mgr, node_mgr, sync_client=client)
+
+    node_mgr.set_status("READY")
+    print(f"[*] Nó {config.node_id} operando em http://{config.node_host}:{config.node_port}")
+    return server
+
+def use_production_server(config):
+    """SERVER_MODE: production (Gunicorn), development (Flask) ou auto (Gunicorn se instalado)."""
+    if config.server_mode == "development":
+        return False
+    if production_server.is_available():
+        return True
+    if config.server_mode == "production":
+        print("[!] Gunicorn indisponível neste ambiente; usando o servidor de desenvolvimento do Flask")
+    return False
+
 def start_peer_gc(peer_manager, interval=600):
     """
     Inicia o Garbage Collector em uma thread separada.
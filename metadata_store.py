@@ -0,0 +1,272 @@
+import os
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+
+def create_metadata_store(storage_provider, config):
+    """Instancia o backend de metadados escolhido em METADATA_BACKEND (json | sqlite)."""
+    backend = getattr(config, 'metadata_backend', "json")
+    if backend == "sqlite":
+        return SqliteMetadataStore(storage_provider)
+    return JsonMetadataStore(storage_provider)
+
+
+class JsonMetadataStore:
+    """Backend padrão: accounts.json/peers.json em data/system e references.json + .log por usuário."""
+
+    compacts_references = True
+
+    def __init__(self, storage_provider, peers_file=None):
+        self.storage = storage_provider
+        base_system = storage_provider.base_system if storage_provider else Path("data/system")
+        self.accounts_file = base_system / "accounts.json"
+        self.peers_file = Path(peers_file) if peers_file else base_system / "peers.json"
+
+    # --- CONTAS ---
+
+    def load_accounts(self):
+        """Retorna a lista de contas ou None se a base ainda não existe."""
+        if not self.accounts_file.exists():
+            return None
+        with open(self.accounts_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_accounts(self, accounts_list: list):
+        with open(self.accounts_file, "w", encoding="utf-8") as f:
+            json.dump(accounts_list, f, indent=4)
+
+    def add_accounts(self, new_accounts: list, accounts_list: list):
+        # O arquivo é um único documento: uma regravação por lote
+        self.save_accounts(accounts_list)
+
+    # --- PEERS ---
+
+    def load_peers(self):
+        """Retorna o dicionário { "ip:port": last_seen } ou None se ainda não existe."""
+        if not self.peers_file.exists():
+            return None
+        with open(self.peers_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_peers(self, peers: dict):
+        with open(self.peers_file, "w", encoding="utf-8") as f:
+            json.dump(peers, f, indent=4)
+
+    # --- REFERÊNCIAS ---
+
+    def _reference_paths(self, user_id):
+        folder = self.storage.get_user_storage_path(user_id)
+        return folder / "references.json", folder / "references.log"
+
+    def references_version(self, user_id):
+        """Token que muda quando os arquivos são alterados (inclusive por fora do processo)."""
+        mtimes = []
+        for path in self._reference_paths(user_id):
+            try:
+                mtimes.append(path.stat().st_mtime_ns)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def load_references(self, user_id):
+        """Lê snapshot + log e retorna (dados, linhas no log)."""
+        ref_path, log_path = self._reference_paths(user_id)
+        data = {"user": user_id, "sequence": 0, "files": [], "last_sync": ""}
+        if ref_path.exists():
+            try:
+                with open(ref_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except Exception:
+                pass
+
+        # Reaplica as entradas anexadas desde a última compactação
+        log_entries = 0
+        if log_path.exists():
+            with open(log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Linha incompleta de uma gravação interrompida
+                        continue
+                    log_entries += 1
+                    data.setdefault("files", []).append(entry)
+                    data["sequence"] = max(data.get("sequence", 0), entry["seq"])
+                    data["last_sync"] = str(datetime.fromtimestamp(entry.get("ts", 0)))
+        return data, log_entries
+
+    def append_references(self, user_id, entries, data):
+        """Anexa apenas as entradas novas ao references.log."""
+        _, log_path = self._reference_paths(user_id)
+        lines = "".join(json.dumps(entry) + "\n" for entry in entries)
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    def compact_references(self, user_id, data):
+        """Consolida snapshot + log em um novo references.json e zera o log."""
+        ref_path, log_path = self._reference_paths(user_id)
+        tmp_path = ref_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, ref_path)
+        # Se cair aqui, o log é reaplicado sobre o snapshot novo sem duplicar (dedupe por seq)
+        with open(log_path, "w", encoding="utf-8"):
+            pass
+
+
+class SqliteMetadataStore:
+    """Backend SQLite (WAL) para nós com centenas de milhares de usuários e envelopes."""
+
+    compacts_references = False
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS accounts (
+            user TEXT PRIMARY KEY,
+            position INTEGER NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS peers (
+            address TEXT PRIMARY KEY,
+            last_seen REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS reference_users (
+            user TEXT PRIMARY KEY,
+            sequence INTEGER NOT NULL DEFAULT 0,
+            last_sync TEXT NOT NULL DEFAULT ''
+        );
+        CREATE TABLE IF NOT EXISTS reference_files (
+            user TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            hash TEXT,
+            ts INTEGER NOT NULL,
+            PRIMARY KEY (user, seq)
+        );
+        CREATE INDEX IF NOT EXISTS idx_reference_files_hash ON reference_files (hash);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, storage_provider, db_path=None):
+        self.storage = storage_provider
+        self.db_path = Path(db_path) if db_path else storage_provider.base_system / "metadata.db"
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+
+    @contextmanager
+    def _begin(self):
+        """Abre uma transação exclusiva da conexão; desfaz tudo se algo falhar."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                yield self._conn
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _transaction(self, statements):
+        """Executa [(sql, params | [params...])] numa única transação."""
+        with self._begin() as conn:
+            for sql, params in statements:
+                if isinstance(params, list):
+                    conn.executemany(sql, params)
+                else:
+                    conn.execute(sql, params)
+
+    def _sync_table(self, table, key, upsert_sql, rows, initialized_key):
+        """Deixa a tabela igual a `rows`: grava só as linhas novas ou alteradas e apaga as que saíram.
+
+        `upsert_sql` deve ignorar linhas iguais (ON CONFLICT ... DO UPDATE ... WHERE); assim uma
+        gravação da lista inteira custa proporcional ao que mudou, não ao tamanho da tabela.
+        """
+        keys = {row[0] for row in rows}
+        with self._begin() as conn:
+            removed = [(k,) for (k,) in conn.execute(f"SELECT {key} FROM {table}") if k not in keys]
+            conn.executemany(f"DELETE FROM {table} WHERE {key} = ?", removed)
+            conn.executemany(upsert_sql, rows)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, '1')", (initialized_key,))
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # --- CONTAS ---
+
+    def load_accounts(self):
+        rows = self._query("SELECT data FROM accounts ORDER BY position")
+        if not rows and not self._query("SELECT 1 FROM meta WHERE key = 'accounts_initialized'"):
+            return None
+        return [json.loads(data) for (data,) in rows]
+
+    def save_accounts(self, accounts_list: list):
+        rows = [(acc['user'], pos, json.dumps(acc)) for pos, acc in enumerate(accounts_list)]
+        self._sync_table("accounts", "user", """
+            INSERT INTO accounts (user, position, data) VALUES (?, ?, ?)
+            ON CONFLICT (user) DO UPDATE SET position = excluded.position, data = excluded.data
+            WHERE accounts.position != excluded.position OR accounts.data != excluded.data
+        """, rows, "accounts_initialized")
+
+    def add_accounts(self, new_accounts: list, accounts_list: list):
+        start = len(accounts_list) - len(new_accounts)
+        rows = [(acc['user'], start + pos, json.dumps(acc)) for pos, acc in enumerate(new_accounts)]
+        self._transaction([
+            ("INSERT OR REPLACE INTO accounts (user, position, data) VALUES (?, ?, ?)", rows),
+            ("INSERT OR REPLACE INTO meta (key, value) VALUES ('accounts_initialized', '1')", ()),
+        ])
+
+    # --- PEERS ---
+
+    def load_peers(self):
+        rows = self._query("SELECT address, last_seen FROM peers")
+        if not rows and not self._query("SELECT 1 FROM meta WHERE key = 'peers_initialized'"):
+            return None
+        return {address: last_seen for address, last_seen in rows}
+
+    def save_peers(self, peers: dict):
+        self._sync_table("peers", "address", """
+            INSERT INTO peers (address, last_seen) VALUES (?, ?)
+            ON CONFLICT (address) DO UPDATE SET last_seen = excluded.last_seen
+            WHERE peers.last_seen != excluded.last_seen
+        """, list(peers.items()), "peers_initialized")
+
+    # --- REFERÊNCIAS ---
+
+    def references_version(self, user_id):
+        # Todas as gravações passam por este processo; não há edição externa a detectar
+        return None
+
+    def load_references(self, user_id):
+        data = {"user": user_id, "sequence": 0, "files": [], "last_sync": ""}
+        rows = self._query("SELECT sequence, last_sync FROM reference_users WHERE user = ?", (user_id,))
+        if rows:
+            data["sequence"], data["last_sync"] = rows[0]
+        data["files"] = [
+            {"seq": seq, "hash": file_hash, "ts": ts}
+            for seq, file_hash, ts in self._query(
+                "SELECT seq, hash, ts FROM reference_files WHERE user = ? ORDER BY seq", (user_id,)
+            )
+        ]
+        return data, 0
+
+    def append_references(self, user_id, entries, data):
+        self._transaction([
+            ("INSERT OR IGNORE INTO reference_files (user, seq, hash, ts) VALUES (?, ?, ?, ?)",
+             [(user_id, e["seq"], e.get("hash"), e.get("ts", 0)) for e in entries]),
+            ("INSERT INTO reference_users (user, sequence, last_sync) VALUES (?, ?, ?) "
+             "ON CONFLICT(user) DO UPDATE SET sequence = excluded.sequence, last_sync = excluded.last_sync",
+             (user_id, data.get("sequence", 0), data.get("last_sync", ""))),
+        ])
+
+    def compact_references(self, user_id, data):
+        # O SQLite já grava por linha; não há log a consolidar
+        pass
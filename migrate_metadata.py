@@ -0,0 +1,66 @@
+import sys
+import json
+from config import Config
+from storage_provider import StorageProvider
+from metadata_store import JsonMetadataStore, SqliteMetadataStore
+
+def _read_user_id(folder):
+    """Recupera o id do usuário gravado no references.json de uma pasta sem conta conhecida."""
+    try:
+        with open(folder / "references.json", "r", encoding="utf-8") as f:
+            return json.load(f).get("user")
+    except Exception:
+        return None
+
+def run_migration():
+    """Importa accounts.json, peers.json e todos os references.json/.log para o metadata.db (SQLite)."""
+    config = Config()
+    config.metadata_backend = "json"
+    storage = StorageProvider(config)
+
+    source = JsonMetadataStore(storage)
+    target = SqliteMetadataStore(storage)
+    print(f"[*] Migrando metadados JSON para {target.db_path}...")
+
+    # 1. Contas
+    accounts = source.load_accounts()
+    if accounts is not None:
+        target.save_accounts(accounts)
+        print(f"[>] {len(accounts)} contas importadas.")
+
+    # 2. Peers
+    peers = source.load_peers()
+    if peers is not None:
+        if isinstance(peers, list):
+            peers = {peer: 0 for peer in peers}
+        target.save_peers(peers)
+        print(f"[>] {len(peers)} peers importados.")
+
+    # 3. Referências: o id do usuário vem do próprio arquivo (a pasta pode ser um Hash)
+    folders = {storage.get_user_folder_name(acc['user']): acc['user'] for acc in accounts or []}
+    imported = 0
+    for folder in storage.base_storage.iterdir():
+        if not folder.is_dir():
+            continue
+        if not (folder / "references.json").exists() and not (folder / "references.log").exists():
+            continue
+
+        user_id = folders.get(folder.name) or _read_user_id(folder)
+        if user_id is None:
+            print(f"[!] Pasta {folder.name} sem conta correspondente. Ignorada.")
+            continue
+
+        data, _ = source.load_references(user_id)
+        files = data.get("files", [])
+        target.append_references(user_id, files, data)
+        imported += len(files)
+
+    print(f"[>] {imported} referências importadas.")
+    print("\n[V] Migração concluída! Defina METADATA_BACKEND=sqlite no .env para usar o novo backend.")
+
+if __name__ == "__main__":
+    try:
+        run_migration()
+    except Exception as e:
+        print(f"[X] Falha na migração: {e}")
+        sys.exit(1)
@@ -1,8 +1,16 @@
 import requests
 import time
+import random
 import threading
 import json
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+from envelope_stream import CHUNK_SIZE, iter_envelope_records
+from chunk_index import read_range
+from fetch_planner import FetchPlanner
+from references_index import to_runs
 
 class NetworkClient:
     def __init__(self, config, account_mgr, peer_mgr):
@@ -11,6 +19,38 @@ class NetworkClient:
         self.peer_mgr = peer_mgr
         self.running = False
 
+        # Pools de execução: um para os peers e outro para as tarefas por usuário
+        self._peer_pool = ThreadPoolExecutor(max_workers=config.sync_max_peers, thread_name_prefix="sync-peer")
+        self._task_pool = ThreadPoolExecutor(max_workers=config.sync_workers, thread_name_prefix="sync-task")
+        # Pool à parte para sondar fontes do swarm: quem espera nele são tarefas do _task_pool
+        self._probe_pool = ThreadPoolExecutor(max_workers=max(config.swarm_max_sources, 1), thread_name_prefix="sync-probe")
+
+        # Limites de concorrência: global (todas as requisições) e por peer
+        self._global_slots = threading.BoundedSemaphore(config.sync_workers)
+        self._peer_slots = {}
+
+        # Sessões HTTP keep-alive, uma por peer
+        self._sessions = {}
+
+        # Última lista de contas por peer (ETag, usuários), reaproveitada em respostas 304
+        self._accounts_cache = {}
+
+        # Última resposta de references por (peer, usuário), reaproveitada em respostas 304
+        self._ref_cache = {}
+
+        # (peer, usuário) -> primeira sequência em que os históricos divergem
+        self.divergences = {}
+
+        # Peers com sincronização em andamento (o agendador não os dispara de novo)
+        self._in_flight = set()
+
+        # (peer, usuário) com busca disparada por anúncio ainda na fila
+        self._scheduled = set()
+
+        self._lock = threading.Lock()
+        # Peers que saem da visão levam junto sessão, vagas e caches (senão crescem com a rotatividade)
+        peer_mgr.add_removed_listener(self._forget_peers)
+
     def start_sync_loop(self):
         """Inicia o ciclo de sincronização em uma thread separada."""
         self.running = True
@@ -19,100 +59,651 @@ class NetworkClient:
         print(f"[*] Network Client ativo (Sincronização a cada {self.config.sync_interval}s)")
 
     def _run(self):
-        """Loop contínuo de sincronização."""
+        """Agendador: cada peer tem sua própria próxima sincronização, conforme a saúde dele."""
+        my_address = f"{self.config.node_host}:{self.config.node_port}"
+        next_round = 0.0
         while self.running:
             try:
-                self.sync_with_peers()
+                with self._lock:
+                    in_flight = set(self._in_flight)
+                free = self.config.sync_max_peers - len(in_flight)
+                exclude = in_flight | {my_address}
+
+                if self.peer_mgr.gossip_enabled():
+                    # Gossip: por rodada, só GOSSIP_FANOUT peers sorteados (custo constante por nó)
+                    due = []
+                    if time.monotonic() >= next_round:
+                        due = self.peer_mgr.sample_targets(self.config.gossip_fanout, exclude=exclude)
+                        next_round = time.monotonic() + self.config.sync_interval * random.uniform(0.8, 1.2)
+                else:
+                    due = self.peer_mgr.get_due_targets(exclude=exclude)
+
+                # Sem esperar a rodada: um peer lento só ocupa a própria vaga
+                for target in due[:max(free, 0)]:
+                    with self._lock:
+                        self._in_flight.add(target)
+                    self._peer_pool.submit(self._run_peer, target)
             except Exception as e:
                 print(f"[!] Erro crítico no loop de sincronização: {e}")
-            
-            time.sleep(self.config.sync_interval)
+
+            time.sleep(min(max(self.peer_mgr.seconds_until_next_due(), 0.2), 1.0))
+
+    def _run_peer(self, target):
+        try:
+            self._sync_peer(target)
+        finally:
+            with self._lock:
+                self._in_flight.discard(target)
+
+    # --- INFRAESTRUTURA HTTP ---
+
+    def _get_session(self, target):
+        """Retorna a sessão keep-alive do peer (pool de conexões dedicado)."""
+        with self._lock:
+            session = self._sessions.get(target)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.config.sync_peer_workers)
+                session.mount("http://", adapter)
+                self._sessions[target] = session
+            return session
+
+    @contextmanager
+    def _slot(self, target):
+        """Reserva uma vaga no limite global e no limite do peer durante a requisição."""
+        with self._lock:
+            peer_slots = self._peer_slots.get(target)
+            if peer_slots is None:
+                peer_slots = threading.BoundedSemaphore(self.config.sync_peer_workers)
+                self._peer_slots[target] = peer_slots
+
+        with peer_slots, self._global_slots:
+            yield self._get_session(target)
+
+    def _forget_peers(self, peer_addresses):
+        """Descarta o estado mantido por peer para endereços que saíram da visão."""
+        removed = set(peer_addresses)
+        with self._lock:
+            for target in removed:
+                # Requisições em andamento seguram a própria referência à sessão e ao semáforo
+                self._sessions.pop(target, None)
+                self._peer_slots.pop(target, None)
+                self._accounts_cache.pop(target, None)
+            for cache in (self._ref_cache, self.divergences):
+                for key in [key for key in list(cache) if key[0] in removed]:
+                    cache.pop(key, None)
+
+    # --- SINCRONIZAÇÃO ---
 
     def sync_with_peers(self):
-        """Varre todos os peers conhecidos em busca de contas e atualizações."""
+        """Rodada completa e imediata com todos os peers, fora do agendador (ex: uso manual)."""
         targets = self.peer_mgr.get_all_targets()
         my_address = f"{self.config.node_host}:{self.config.node_port}"
-        
-        for target in targets:
-            # Não sincroniza consigo mesmo
-            if target == my_address:
-                continue
 
-            try:
-                # 1. Busca a lista de contas do Peer (Descoberta)
-                response = requests.get(f"http://{target}/accounts", timeout=5)
-                if response.status_code != 200:
-                    continue
-                
+        # Não sincroniza consigo mesmo
+        futures = [
+            self._peer_pool.submit(self._sync_peer, target)
+            for target in targets if target != my_address
+        ]
+        # A rodada dura aproximadamente o tempo do peer mais lento
+        wait(futures)
+
+    def schedule_fetch(self, target, user_id, sequence):
+        """Agenda a busca de um envelope anunciado pelo Peer, sem esperar o próximo ciclo."""
+        if self.account_mgr.get_account(user_id) is None:
+            # Conta ainda desconhecida: a sincronização do peer inteiro a descobre
+            with self._lock:
+                if target in self._in_flight:
+                    return
+                self._in_flight.add(target)
+            self._peer_pool.submit(self._run_peer, target)
+            return
+
+        if self.account_mgr.has_sequence(user_id, sequence):
+            return
+
+        key = (target, user_id)
+        with self._lock:
+            if key in self._scheduled:
+                # Uma busca já pendente vai trazer também esta sequência
+                return
+            self._scheduled.add(key)
+        self._task_pool.submit(self._run_scheduled, target, user_id)
+
+    def _run_scheduled(self, target, user_id):
+        with self._lock:
+            self._scheduled.discard((target, user_id))
+        self._check_for_updates(target, user_id)
+
+    def _sync_peer(self, target):
+        """Sincroniza contas e envelopes de um único peer e registra a saúde dele no PeerManager."""
+        try:
+            # 1. Busca a lista de contas do Peer (Descoberta)
+            cached = self._accounts_cache.get(target)
+            headers = {"If-None-Match": cached[0]} if cached else {}
+            with self._slot(target) as session:
+                started = time.monotonic()
+                response = session.get(f"http://{target}/accounts", headers=headers, timeout=5)
+                rtt = time.monotonic() - started
+
+            changed = False
+            if response.status_code == 304 and cached:
+                # Lista inalterada no Peer: nada a mesclar
+                remote_users = cached[1]
+            elif response.status_code == 200:
                 remote_accounts = response.json()
-                for acc in remote_accounts:
-                    # Persiste a conta no nó local (SC) se ela for nova
-                    # Isso cria o accounts.json em data/system se necessário
-                    self.account_mgr.add_account(acc)
-                    
-                    # 2. Verifica se o peer tem arquivos novos para este usuário
-                    self._check_for_updates(target, acc['user'])
+                # Persiste de uma só vez as contas novas no nó local (SC)
+                changed = self.account_mgr.merge_accounts(remote_accounts) > 0
+                remote_users = [acc['user'] for acc in remote_accounts]
+                etag = response.headers.get("ETag")
+                if etag:
+                    self._accounts_cache[target] = (etag, remote_users)
+            else:
+                raise RuntimeError(f"HTTP {response.status_code} em /accounts")
 
-            except Exception:
-                # Falhas de conexão são ignoradas; o PeerManager/GC lidam com peers mortos
-                pass
+            # Troca de amostras da visão de peers (só no gossip; no modo completo todos já se conhecem)
+            if self.peer_mgr.gossip_enabled():
+                self._exchange_peers(target)
 
-    def _check_for_updates(self, target, user_id):
-        """Compara a sequência local com a remota e inicia o download."""
+            # 2. Verifica se o peer tem arquivos novos para cada usuário
+            futures = [
+                self._task_pool.submit(self._check_for_updates, target, user_id)
+                for user_id in remote_users
+            ]
+            wait(futures)
+            results = [f.result() for f in futures]
+            if results and all(result is None for result in results):
+                # /accounts respondeu, mas nenhum /references: o peer não está servindo
+                raise RuntimeError("todas as consultas de referências falharam")
+            changed = changed or any(results)
+            self.peer_mgr.record_success(target, rtt, changed)
+
+        except Exception as e:
+            failures = self.peer_mgr.record_failure(target)
+            # Loga só a primeira falha da sequência; as demais ficam no backoff em silêncio
+            if failures == 1:
+                print(f"[!] Peer {target} indisponível ({e.__class__.__name__}); tentativas em backoff")
+
+    def _get_references(self, target, user_id):
+        """Busca (ou revalida via ETag) o mapa remoto; retorna (referências, se vieram novas)."""
+        # Pergunta apenas o que o Peer tem além do nosso prefixo contíguo (inclui as lacunas)
+        url = f"http://{target}/accounts/{user_id}/references"
+        params = {"since": self.account_mgr.get_contiguous_sequence(user_id)}
+        cached = self._ref_cache.get((target, user_id))
+        headers = {"If-None-Match": cached[0]} if cached else {}
+
+        with self._slot(target) as session:
+            response = session.get(url, params=params, headers=headers, timeout=5)
+
+        if response.status_code == 304 and cached:
+            # Nada mudou no Peer: reaproveita a última resposta sem transferir o histórico
+            return cached[1], False
+        if response.status_code == 200:
+            remote_ref = response.json()
+            etag = response.headers.get("ETag")
+            if etag:
+                self._ref_cache[(target, user_id)] = (etag, remote_ref)
+            return remote_ref, True
+        return None, False
+
+    def _exchange_peers(self, target):
+        """Envia uma amostra da nossa visão ao peer e incorpora a amostra que ele devolve."""
+        target_host = target.rsplit(":", 1)[0]
+        payload = {
+            "from": f"{self.config.node_host}:{self.config.node_port}",
+            "peers": self.peer_mgr.sample_view(self.config.peer_exchange_size, exclude=(target,), for_host=target_host),
+        }
         try:
-            # Pergunta qual a sequência atual do usuário no Peer
-            url = f"http://{target}/accounts/{user_id}/references"
-            response = requests.get(url, timeout=5)
-            
+            with self._slot(target) as session:
+                response = session.post(f"http://{target}/peers", json=payload, timeout=5)
             if response.status_code == 200:
-                remote_ref = response.json()
-                remote_seq = remote_ref.get("sequence", 0)
-                local_seq = self.account_mgr.get_local_sequence(user_id)
+                added = self.peer_mgr.merge_peers(response.json().get("peers", []), origin_host=target_host)
+                if added:
+                    print(f"[*] Gossip: {added} peer(s) novo(s) recebidos de {target}")
+        except Exception as e:
+            print(f"[!] Falha na troca de peers com {target}: {e}")
+
+    def _check_for_updates(self, target, user_id):
+        """Compara a sequência local com a remota e inicia o download.
+
+        Retorna True se havia envelopes a baixar, False se não havia e None se a consulta
+        ao peer falhou (o _sync_peer conta isso na saúde do peer).
+        """
+        try:
+            remote_ref, fresh = self._get_references(target, user_id)
+            if remote_ref is None:
+                return None
+            if fresh:
+                # Histórico divergente: não mistura envelopes dos dois lados
+                if not self._verify_chain(target, user_id, remote_ref):
+                    return False
+            elif (target, user_id) in self.divergences:
+                return False
+
+            remote_seq = remote_ref.get("sequence", 0)
+            # Peers antigos não informam as faixas; assume-se 1..sequence
+            remote_held = remote_ref.get("held") or ([[1, remote_seq]] if remote_seq else [])
 
-                # Se o Peer tem algo mais novo, baixamos os arquivos faltantes
-                if remote_seq > local_seq:
-                    print(f"[*] Peer {target} tem novidades para {user_id} ({local_seq} -> {remote_seq})")
-                    
-                    for seq in range(local_seq + 1, remote_seq + 1):
-                        self._fetch_user_file(target, user_id, seq, remote_ref)
+            # Evita que dois peers baixem o mesmo usuário ao mesmo tempo (outros usuários seguem em paralelo)
+            with self.account_mgr.storage.transfer_lock(user_id):
+                # Exatamente o que o Peer tem e nós não: lacunas antigas e envelopes novos
+                missing = self.account_mgr.get_missing_sequences(user_id, remote_held)
+
+                if missing:
+                    local_seq = self.account_mgr.get_local_sequence(user_id)
+                    print(f"[*] Peer {target} tem {len(missing)} envelope(s) faltante(s) para {user_id} (local {local_seq}, remoto {remote_seq})")
+                    self._download_missing(target, user_id, missing, remote_ref)
+                    return True
+            return False
 
         except Exception as e:
             print(f"[!] Erro ao checar atualizações em {target} para {user_id}: {e}")
+            return None
+
+    def _get_remote_digest(self, target, user_id, sequence):
+        """Consulta o digest do histórico remoto até `sequence` (None se indisponível)."""
+        url = f"http://{target}/accounts/{user_id}/digest"
+        with self._slot(target) as session:
+            response = session.get(url, params={"seq": sequence}, timeout=5)
+        if response.status_code != 200:
+            return None
+        return response.json().get("digest")
+
+    def _verify_chain(self, target, user_id, remote_ref):
+        """Compara as cadeias de hashes local e remota; retorna False se os históricos divergem.
+
+        Raízes iguais custam zero ou uma requisição; achar o ponto de divergência usa
+        busca binária sobre o prefixo comum (O(log n) requisições).
+        """
+        remote_chain = remote_ref.get("chain")
+        if not remote_chain:
+            # Peer sem cadeia de hashes: só resta a comparação por sequência
+            return True
+
+        local_head = self.account_mgr.get_digest(user_id)["head"]
+        common = min(local_head, remote_chain["head"])
+        if common == 0:
+            return True
+
+        if common == remote_chain["head"]:
+            remote_root = remote_chain["root"]
+        else:
+            remote_root = self._get_remote_digest(target, user_id, common)
+
+        if remote_root is None or remote_root == self.account_mgr.get_digest(user_id, common)["digest"]:
+            self.divergences.pop((target, user_id), None)
+            return True
+
+        # Invariante: os digests diferem em `high`; procura o primeiro elo diferente
+        low, high = 1, common
+        while low < high:
+            mid = (low + high) // 2
+            remote_digest = self._get_remote_digest(target, user_id, mid)
+            if remote_digest is None:
+                return False
+            if remote_digest == self.account_mgr.get_digest(user_id, mid)["digest"]:
+                low = mid + 1
+            else:
+                high = mid
+
+        print(f"[!] Histórico de {user_id} diverge de {target} a partir da seq {low}")
+        self.divergences[(target, user_id)] = low
+        return False
+
+    def _download_missing(self, target, user_id, missing, remote_ref):
+        """Baixa as sequências faltantes, pulando o que já existe localmente com o mesmo hash."""
+        # Hashes do peer cujo histórico acabou de ser verificado: valem para qualquer fonte
+        hashes = {f_meta["seq"]: f_meta.get("hash") for f_meta in remote_ref.get("files", [])}
+        # Envelopes em chunks no peer: versões novas de um arquivo trafegam só pelo que mudou
+        chunked = {seq for start, end in remote_ref.get("chunked", []) for seq in range(start, end + 1)}
+
+        # Conteúdo já presente no armazenamento por conteúdo vira hardlink, sem tráfego
+        to_fetch = []
+        for seq in missing:
+            if self.account_mgr.link_envelope_from_blob(user_id, seq, hashes.get(seq)):
+                print(f"[+] Envelope {str(seq).zfill(4)}.dat.gz de {user_id} reaproveitado localmente (hash já conhecido)")
+            else:
+                to_fetch.append(seq)
+        if not to_fetch:
+            return
+
+        sources = self._find_sources(target, user_id, to_fetch, hashes, remote_ref)
+        if len(sources) == 1:
+            self._fetch_sequences(target, user_id, to_fetch, hashes, chunked)
+            return
+
+        # Vários peers têm o mesmo trecho: cada um puxa peças conforme a própria vazão
+        planner = FetchPlanner(to_fetch, self.config.swarm_piece_size)
+        print(f"[*] Baixando {len(to_fetch)} envelope(s) de {user_id} de {len(sources)} peers em paralelo")
+        workers = [
+            threading.Thread(target=self._swarm_worker, args=(planner, peer, held, user_id, hashes, chunked), daemon=True)
+            for peer, held in sources.items()
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
 
-    def _fetch_user_file(self, target, user_id, sequence, remote_ref):
-        """Baixa o envelope .dat.gz e delega o salvamento ao AccountManager."""
+        remaining = planner.remaining()
+        if remaining:
+            print(f"[!] {remaining} envelope(s) de {user_id} ficaram para a próxima rodada")
+
+    def _find_sources(self, target, user_id, to_fetch, hashes, remote_ref):
+        """Peers que anunciam parte do que falta (pela última resposta de /references), mais rápidos primeiro."""
+        first, last = to_fetch[0], to_fetch[-1]
+        sources = {target: remote_ref.get("held") or [[1, remote_ref.get("sequence", 0)]]}
+        self._probe_sources(target, user_id)
+
+        for (peer, cached_user), (_, ref) in list(self._ref_cache.items()):
+            if cached_user != user_id or peer in sources or (peer, user_id) in self.divergences:
+                continue
+            held = ref.get("held") or [[1, ref.get("sequence", 0)]]
+            if not any(start <= last and end >= first for start, end in held):
+                continue
+            # Só entra quem concorda com os hashes do peer verificado
+            peer_hashes = {f_meta["seq"]: f_meta.get("hash") for f_meta in ref.get("files", [])}
+            if any(peer_hashes.get(seq, hashes.get(seq)) != hashes.get(seq) for seq in to_fetch):
+                continue
+            sources[peer] = held
+
+        ranked = sorted(sources, key=lambda peer: self.peer_mgr.get_throughput(peer), reverse=True)
+        if target not in ranked[:self.config.swarm_max_sources]:
+            ranked.insert(0, target)
+        return {peer: sources[peer] for peer in ranked[:max(self.config.swarm_max_sources, 1)]}
+
+    def _probe_sources(self, target, user_id):
+        """Atualiza em paralelo as referências dos outros peers saudáveis que listam o usuário."""
+        my_address = f"{self.config.node_host}:{self.config.node_port}"
+        candidates = [
+            peer for peer in self.peer_mgr.get_all_targets()
+            if peer not in (target, my_address)
+            and (peer, user_id) not in self.divergences
+            and user_id in self._accounts_cache.get(peer, (None, ()))[1]
+            and self.peer_mgr.is_healthy(peer)
+        ]
+        # Só os mais rápidos podem virar fonte: sondar além disso é custo sem retorno
+        candidates.sort(key=self.peer_mgr.get_throughput, reverse=True)
+        candidates = candidates[:max(self.config.swarm_max_sources - 1, 0)]
+
+        def probe(peer):
+            try:
+                self._get_references(peer, user_id)
+            except Exception:
+                pass
+
+        # Pool próprio e limitado: o de tarefas pode estar ocupado pela própria sincronização
+        wait([self._probe_pool.submit(probe, peer) for peer in candidates])
+
+    def _swarm_worker(self, planner, peer, held, user_id, hashes, chunked):
+        """Puxa peças do planejador até acabar o trabalho ou o peer falhar demais."""
+        failures = 0
+        while failures < 2:
+            piece = planner.next_piece(peer, held)
+            if piece is None:
+                return
+            start, end = piece
+            failed = list(range(start, end + 1))
+            try:
+                failed = self._fetch_sequences(peer, user_id, list(range(start, end + 1)), hashes, chunked)
+            except Exception as e:
+                print(f"[!] Falha ao baixar a peça {start}-{end} de {user_id} de {peer}: {e}")
+            finally:
+                planner.complete(piece, failed, peer)
+            if failed:
+                # Peça incompleta (peer lento, fora do ar ou hash errado): outro peer assume o que faltou
+                failures += 1
+
+    def _fetch_sequences(self, target, user_id, sequences, hashes, chunked=()):
+        """Baixa `sequences` (ordenadas) de um peer; retorna as sequências que não chegaram.
+
+        Uma falha não interrompe as seguintes (as referências em faixas aceitam lacunas);
+        só depois de falhas seguidas o peer é dado como fora do ar e o resto fica para depois.
+        Sequências em `chunked` tentam primeiro a transferência por chunks; as demais seguem
+        em lote ou arquivo a arquivo.
+        """
+        started = time.monotonic()
+        received_bytes = 0
+        failed = []
+        streak = 0
+        user_dir = self.account_mgr.storage.get_user_storage_path(user_id)
+
+        for start, end in _runs_by_kind(sequences, chunked):
+            next_seq = start
+            # Faixas longas seguem em lote; o restante (ou peers antigos) vai arquivo a arquivo
+            if streak < 3 and start not in chunked and self.config.bulk_max_records > 0 and end > start:
+                next_seq = self._fetch_user_range(target, user_id, start, end, hashes)
+                received_bytes += sum(
+                    (user_dir / f"{str(seq).zfill(4)}.dat.gz").stat().st_size for seq in range(start, next_seq)
+                )
+
+            for seq in range(next_seq, end + 1):
+                if streak >= 3:
+                    failed.append(seq)
+                    continue
+                received = self._fetch_one(target, user_id, seq, hashes.get(seq), seq in chunked)
+                if received is None:
+                    failed.append(seq)
+                    streak += 1
+                else:
+                    received_bytes += received
+                    streak = 0
+
+        self.peer_mgr.record_throughput(target, received_bytes, time.monotonic() - started)
+        if failed:
+            print(f"[!] {len(failed)} envelope(s) de {user_id} não vieram de {target}; ficam para a próxima tentativa")
+        return failed
+
+    def _fetch_one(self, target, user_id, sequence, file_hash, chunked):
+        """Baixa um envelope; retorna os bytes contabilizados na vazão ou None se falhou."""
+        manifest = None
+        if chunked:
+            # O manifesto acompanha também o download inteiro: a próxima versão já aproveita os chunks
+            manifest = self._get_manifest(target, user_id, sequence, file_hash)
+            if manifest:
+                transferred = self._fetch_chunked_file(target, user_id, sequence, file_hash, manifest)
+                if transferred is not None:
+                    return transferred
+
+        # Sem chunks reaproveitáveis (ou se a transferência por chunks falhar) o envelope vem inteiro
+        if not self._fetch_user_file(target, user_id, sequence, file_hash, manifest):
+            return None
+        filename = f"{str(sequence).zfill(4)}.dat.gz"
+        return (self.account_mgr.storage.get_user_storage_path(user_id) / filename).stat().st_size
+
+    def _fetch_user_range(self, target, user_id, start, end, hashes=None):
+        """Baixa a faixa de envelopes em fluxos em lote e retorna a próxima sequência pendente."""
+        next_seq = start
+        while next_seq <= end:
+            batch_end = min(end, next_seq + self.config.bulk_max_records - 1)
+            url = f"http://{target}/accounts/{user_id}/envelopes"
+            params = {"from": next_seq, "to": batch_end}
+            # Commits enviados ao commit em grupo enquanto o fluxo segue chegando
+            submitted = []
+            stop = False
+
+            try:
+                with self._slot(target) as session:
+                    with session.get(url, params=params, stream=True, timeout=(5, self.config.swarm_stall_timeout)) as response:
+                        if response.status_code != 200:
+                            # Peer sem suporte à rota em lote: volta ao download individual
+                            return next_seq
+
+                        expected = next_seq
+                        for header, chunks in iter_envelope_records(response.raw):
+                            sequence = header["seq"]
+                            # Um registro fora de ordem indica uma lacuna no peer; o restante fica para o modo individual
+                            if sequence != expected:
+                                stop = True
+                                break
+
+                            # Cada registro é gravado em disco conforme chega, sem bufferizar o envelope
+                            future = self.account_mgr.receive_envelope(
+                                user_id=user_id,
+                                chunks=chunks,
+                                sequence=sequence,
+                                file_hash=(hashes or {}).get(sequence) or header.get("hash"),
+                                partial_offset=0,
+                                wait=False
+                            )
+                            if not future:
+                                stop = True
+                                break
+                            submitted.append((sequence, future))
+                            expected += 1
+            except Exception as e:
+                print(f"[!] Falha na transferência em lote de {user_id} a partir de {target}: {e}")
+                stop = True
+
+            # Avança só até o primeiro envelope que não foi confirmado
+            received = 0
+            for sequence, future in submitted:
+                if future.result() is None:
+                    stop = True
+                    break
+                next_seq = sequence + 1
+                received += 1
+
+            if received:
+                print(f"[+] {received} envelopes de {user_id} sincronizados em lote de {target}")
+            if stop or received == 0:
+                return next_seq
+
+        return next_seq
+
+    def _fetch_user_file(self, target, user_id, sequence, file_hash, manifest=None):
+        """Baixa o envelope .dat.gz em streaming e delega o salvamento ao AccountManager."""
         filename = f"{str(sequence).zfill(4)}.dat.gz"
         # Rota padronizada conforme o NetworkServer
         url = f"http://{target}/accounts/{user_id}/download/{filename}"
-        
+
+        # Um .part de rodadas anteriores é continuado a partir do seu tamanho atual
+        part_path = self.account_mgr.get_partial_path(user_id, sequence)
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+
         try:
-            response = requests.get(url, timeout=15)
-            if response.status_code == 200:
-                # Tenta localizar o hash desse arquivo específico nos metadados remotos
-                file_hash = None
-                if "files" in remote_ref:
-                    for f_meta in remote_ref["files"]:
-                        if f_meta["seq"] == sequence:
-                            file_hash = f_meta.get("hash")
-                            break
-
-                # Entrega os bytes para o AccountManager salvar no local correto (Hash ou Plain)
-                # O manager também atualizará o references.json local
-                success = self.account_mgr.save_remote_envelope(
-                    user_id=user_id,
-                    data_bytes=response.content,
-                    sequence=sequence,
-                    file_hash=file_hash
-                )
-                
-                if success:
-                    print(f"[+] Envelope {filename} sincronizado com sucesso de {target}")
-            else:
-                print(f"[!] Erro ao baixar {filename}: Status {response.status_code}")
-                
+            with self._slot(target) as session:
+                # O timeout de leitura detecta peers parados no meio da transferência
+                with session.get(url, headers=headers, stream=True, timeout=(5, self.config.swarm_stall_timeout)) as response:
+                    if response.status_code == 206:
+                        print(f"[*] Retomando {filename} de {target} a partir de {offset} bytes")
+                    elif response.status_code == 200:
+                        # O peer ignorou o Range: recomeça do zero
+                        offset = 0
+                    elif response.status_code == 416:
+                        # O .part já tem o tamanho total: basta validar e concluir
+                        pass
+                    else:
+                        print(f"[!] Erro ao baixar {filename}: Status {response.status_code}")
+                        return False
+
+                    # Os blocos vão direto para o .part com SHA-256 calculado em trânsito
+                    # O manager valida o hash, move para o local correto e atualiza o references.json
+                    chunks = [] if response.status_code == 416 else response.iter_content(chunk_size=CHUNK_SIZE)
+                    success = self.account_mgr.receive_envelope(
+                        user_id=user_id,
+                        chunks=chunks,
+                        sequence=sequence,
+                        file_hash=file_hash,
+                        partial_offset=offset,
+                        manifest=manifest
+                    )
+
+            if success:
+                print(f"[+] Envelope {filename} sincronizado com sucesso de {target}")
+            return success
+
         except Exception as e:
             print(f"[!] Falha no download de {filename} de {target}: {e}")
+            return False
+
+    def _get_manifest(self, target, user_id, sequence, file_hash):
+        """Manifesto de chunks do envelope no peer, ou None se indisponível ou de outro conteúdo."""
+        filename = f"{str(sequence).zfill(4)}.dat.gz"
+        try:
+            with self._slot(target) as session:
+                response = session.get(f"http://{target}/accounts/{user_id}/manifest/{sequence}", timeout=5)
+            if response.status_code != 200:
+                return None
+            manifest = response.json()
+            chunks = manifest["chunks"]
+            if not all(isinstance(h, str) and isinstance(size, int) and size > 0 for h, size in chunks):
+                raise ValueError("entradas malformadas")
+        except Exception as e:
+            print(f"[!] Manifesto de {filename} de {target} indisponível: {e}")
+            return None
+
+        if not file_hash or manifest.get("hash") != file_hash:
+            return None
+        return manifest
+
+    def _fetch_chunked_file(self, target, user_id, sequence, file_hash, manifest):
+        """Monta o envelope a partir do manifesto: chunks já presentes vêm do disco, só os novos da rede.
+
+        Retorna os bytes transferidos, ou None se falhou ou se nenhum chunk é reaproveitável
+        (aí o download inteiro é melhor, porque pode ser retomado via Range).
+        """
+        filename = f"{str(sequence).zfill(4)}.dat.gz"
+        chunk_index = self.account_mgr.chunks
+        local = [chunk_index.locate(user_id, chunk_hash) for chunk_hash, _ in manifest["chunks"]]
+        wanted = [chunk_hash for (chunk_hash, _), location in zip(manifest["chunks"], local) if location is None]
+        if len(wanted) == len(local):
+            return None
+
+        def assemble(records):
+            """Intercala, na ordem do manifesto, chunks lidos do disco e chunks recebidos do peer.
+
+            Os hashes de cada chunk e do envelope inteiro são conferidos pelo manager na gravação.
+            """
+            position = 0
+            for (chunk_hash, length), location in zip(manifest["chunks"], local):
+                if location is not None:
+                    yield from read_range(*location)
+                    continue
+                header, blocks = next(records)
+                if header["seq"] != position or header["hash"] != chunk_hash or header["size"] != length:
+                    raise ValueError(f"chunk {position} ausente no fluxo do peer")
+                position += 1
+                yield from blocks
+
+        # Um chunk errado ou ausente descarta a montagem (o manager remove o temporário)
+        try:
+            with self._slot(target) as session:
+                url = f"http://{target}/accounts/{user_id}/chunks"
+                with session.post(url, json={"chunks": wanted}, stream=True, timeout=(5, self.config.swarm_stall_timeout)) as response:
+                    if response.status_code != 200:
+                        return None
+                    success = self.account_mgr.receive_envelope(
+                        user_id=user_id,
+                        chunks=assemble(iter_envelope_records(response.raw)),
+                        sequence=sequence,
+                        file_hash=file_hash,
+                        manifest=manifest
+                    )
+        except Exception as e:
+            print(f"[!] Falha na transferência por chunks de {filename} de {target}: {e}")
+            return None
+
+        if not success:
+            return None
+        total = sum(length for _, length in manifest["chunks"])
+        transferred = sum(length for (_, length), location in zip(manifest["chunks"], local) if location is None)
+        print(f"[+] Envelope {filename} de {user_id} sincronizado por chunks de {target} ({transferred} de {total} bytes transferidos)")
+        return transferred
 
     def stop(self):
         """Para o loop de sincronização."""
-        self.running = False
\ No newline at end of file
+        self.running = False
+        self._peer_pool.shutdown(wait=False)
+        self._task_pool.shutdown(wait=False)
+        self._probe_pool.shutdown(wait=False)
+        for session in self._sessions.values():
+            session.close()
+
+
+def _runs_by_kind(sequences, chunked):
+    """Faixas contíguas (`to_runs`) em que uma faixa nunca mistura sequências em chunks e comuns."""
+    return sorted(
+        to_runs([seq for seq in sequences if seq in chunked])
+        + to_runs([seq for seq in sequences if seq not in chunked])
+    )
@@ -1,52 +1,194 @@
-import json
-from flask import Flask, jsonify, send_file
+from flask import Flask, Response, jsonify, request, send_file, stream_with_context
 from pathlib import Path
+from envelope_stream import CHUNK_SIZE, stream_chunk_ranges, stream_envelope_files
+from peer_manager import is_loopback_host, is_wildcard_host
+from references_index import to_runs
+from response_cache import ResponseCache
 
 class NetworkServer:
-    def __init__(self, config, account_mgr, peer_mgr, node_mgr):
+    def __init__(self, config, account_mgr, peer_mgr, node_mgr, sync_client=None):
         self.config = config
         self.account_mgr = account_mgr
         self.peer_mgr = peer_mgr
         self.node_mgr = node_mgr
+        self.sync_client = sync_client
         
         self.app = Flask(__name__)
 
+        # Corpos prontos (JSON serializado e gzip) das respostas mais consultadas pelos peers
+        self.response_cache = ResponseCache(
+            max_bytes=config.response_cache_mb * 1024 * 1024,
+            gzip_min_size=config.response_gzip_min_bytes,
+            gzip_level=config.gzip_level
+        )
+        # O ETag já impede respostas velhas; as invalidações liberam a memória na hora
+        account_mgr.add_commit_listener(lambda user_id, sequence, file_hash: self.response_cache.invalidate_user(user_id))
+        account_mgr.add_accounts_listener(lambda new_accounts: self.response_cache.invalidate(("accounts",)))
+
         # --- DEFINIÇÃO DAS ROTAS (DENTRO DO ESCOPO DA CLASSE) ---
 
         @self.app.route('/accounts', methods=['GET'])
         def get_accounts():
-            """Retorna a lista de contas autorizadas neste nó."""
+            """Retorna a lista de contas autorizadas neste nó (304 se a versão não mudou)."""
             try:
-                return jsonify(self.account_mgr.accounts), 200
+                etag = f"{self.account_mgr.service.references.epoch}-{self.account_mgr.accounts_version}"
+                if request.if_none_match.contains(etag):
+                    response = Response(status=304)
+                    response.set_etag(etag)
+                    return response
+
+                return self._cached_json(("accounts",), etag, lambda: self.account_mgr.accounts), 200
             except Exception as e:
                 return jsonify({"error": str(e)}), 500
         
         @self.app.route('/accounts/<user_id>/references', methods=['GET'])
         def get_user_references(user_id):
-            """Busca o references.json usando o StorageProvider via AccountManager."""
-            # Agora pedimos o caminho correto para o StorageProvider que está dentro do Manager
-            folder_path = self.account_mgr.storage.get_user_storage_path(user_id)
-            ref_path = folder_path / "references.json"
-            
-            if ref_path.exists():
-                try:
-                    with open(ref_path, "r", encoding="utf-8") as f:
-                        return jsonify(json.load(f)), 200
-                except Exception as e:
-                    return jsonify({"error": f"Erro ao ler referências: {e}"}), 500
-            
-            return jsonify({"user": user_id, "sequence": 0, "files": []}), 200
+            """Serve o mapa de referências (completo ou apenas o delta após `since`) com suporte a ETag/304."""
+            try:
+                since = int(request.args.get("since", 0))
+            except ValueError:
+                return jsonify({"error": "Parâmetro 'since' deve ser inteiro"}), 400
+
+            # O índice em memória compartilhado com o AccountService evita reler o arquivo
+            references = self.account_mgr.service.references
+
+            # A versão do índice e o `since` compõem o ETag da resposta
+            etag = f"{references.get_version(user_id)}-{since}"
+
+            # Nada mudou desde a última consulta do peer: responde sem corpo
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            return self._cached_json(("references", user_id, since), etag, lambda: self._references_body(user_id, since)), 200
+
+        @self.app.route('/accounts/<user_id>/digest', methods=['GET'])
+        def get_user_digest(user_id):
+            """Raiz da cadeia de hashes do usuário e, com `seq`, o digest do histórico até essa sequência."""
+            try:
+                sequence = request.args.get("seq")
+                sequence = int(sequence) if sequence is not None else None
+            except ValueError:
+                return jsonify({"error": "Parâmetro 'seq' deve ser inteiro"}), 400
+
+            return jsonify(self.account_mgr.service.references.get_digest(user_id, sequence)), 200
 
         @self.app.route('/accounts/<user_id>/download/<filename>', methods=['GET'])
         def download_envelope(user_id, filename):
-            """Entrega o arquivo usando o caminho resolvido pelo StorageProvider."""
+            """Entrega o arquivo (inteiro ou parcial via Range) usando o caminho resolvido pelo StorageProvider."""
             folder_path = self.account_mgr.storage.get_user_storage_path(user_id)
             file_path = folder_path / filename
-            
-            if file_path.exists():
-                return send_file(file_path, as_attachment=True)
-            
-            return jsonify({"error": "Arquivo não encontrado"}), 404
+
+            if not file_path.exists():
+                return jsonify({"error": "Arquivo não encontrado"}), 404
+
+            file_wrapper = request.environ.get("wsgi.file_wrapper")
+            if file_wrapper is not None and "If-Range" not in request.headers:
+                # Servidor de produção: o arquivo vai direto do disco para o socket (sendfile)
+                return self._send_envelope(file_path, file_wrapper)
+
+            # conditional=True habilita Range/206 e If-Range; o caminho absoluto evita
+            # que o Flask resolva o arquivo relativo à pasta do código
+            return send_file(file_path.resolve(), as_attachment=True, conditional=True)
+
+        @self.app.route('/accounts/<user_id>/manifest/<int:sequence>', methods=['GET'])
+        def get_manifest(user_id, sequence):
+            """Manifesto de um envelope em chunks: [[hash do membro gzip, tamanho], ...] na ordem do arquivo."""
+            manifest = self.account_mgr.chunks.get_manifest(user_id, sequence)
+            if manifest is None:
+                return jsonify({"error": "Envelope sem manifesto de chunks"}), 404
+
+            # O envelope de uma sequência nunca muda: o hash dele serve de ETag
+            etag = manifest["hash"]
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            response = jsonify(manifest)
+            response.set_etag(etag)
+            return response
+
+        @self.app.route('/accounts/<user_id>/chunks', methods=['POST'])
+        def stream_chunks(user_id):
+            """Entrega os chunks pedidos (lista de hashes) em um único fluxo, na ordem do pedido."""
+            payload = request.get_json(silent=True) or {}
+            hashes = payload.get("chunks")
+            if not isinstance(hashes, list):
+                return jsonify({"error": "Campo 'chunks' deve ser uma lista de hashes"}), 400
+
+            chunks = self.account_mgr.chunks
+            entries = []
+            for index, chunk_hash in enumerate(hashes):
+                location = chunks.locate(user_id, chunk_hash) if isinstance(chunk_hash, str) else None
+                if location is None:
+                    # O fluxo para no primeiro chunk desconhecido; o cliente baixa o envelope inteiro
+                    break
+                entries.append((index, chunk_hash) + location)
+
+            return Response(
+                stream_with_context(stream_chunk_ranges(entries)),
+                mimetype="application/octet-stream"
+            )
+
+        @self.app.route('/accounts/<user_id>/envelopes', methods=['GET'])
+        def stream_envelopes(user_id):
+            """Entrega uma faixa de sequências (from..to) em um único fluxo com framing por registro."""
+            try:
+                start = int(request.args.get("from", 1))
+                end = int(request.args.get("to", start))
+            except ValueError:
+                return jsonify({"error": "Parâmetros 'from' e 'to' devem ser inteiros"}), 400
+
+            folder_path = self.account_mgr.storage.get_user_storage_path(user_id)
+            hashes = self.account_mgr.service.references.get_hashes(user_id)
+
+            # Limita a faixa ao que este nó realmente conhece
+            end = min(end, max(hashes, default=0))
+            entries = (
+                (seq, hashes.get(seq), folder_path / f"{str(seq).zfill(4)}.dat.gz")
+                for seq in range(max(start, 1), end + 1)
+            )
+            return Response(
+                stream_with_context(stream_envelope_files(entries)),
+                mimetype="application/octet-stream"
+            )
+
+        @self.app.route('/announce', methods=['POST'])
+        def receive_announce():
+            """Recebe o aviso de um Peer de que há envelope novo e agenda a busca imediata."""
+            payload = request.get_json(silent=True) or {}
+            user_id = payload.get("user")
+            sender = payload.get("from", "")
+            try:
+                sequence = int(payload.get("seq"))
+            except (TypeError, ValueError):
+                return jsonify({"error": "Campos 'user', 'seq' e 'from' são obrigatórios"}), 400
+            if not user_id or ":" not in sender:
+                return jsonify({"error": "Campos 'user', 'seq' e 'from' são obrigatórios"}), 400
+
+            sender = self._sender_address(sender)
+            self.peer_mgr.add_peer_by_address(sender)
+            if self.sync_client is not None:
+                self.sync_client.schedule_fetch(sender, user_id, sequence)
+            return jsonify({"status": "accepted"}), 202
+
+        @self.app.route('/peers', methods=['GET', 'POST'])
+        def exchange_peers():
+            """Troca de peers (gossip): incorpora a amostra recebida e devolve uma amostra da nossa visão."""
+            payload = request.get_json(silent=True) or {}
+            sender = payload.get("from", "")
+            if ":" in sender:
+                sender = self._sender_address(sender)
+                self.peer_mgr.add_peer_by_address(sender)
+
+            received = payload.get("peers", [])
+            if isinstance(received, list):
+                self.peer_mgr.merge_peers(received[:self.config.peer_exchange_size + 1], origin_host=request.remote_addr)
+
+            sample = self.peer_mgr.sample_view(self.config.peer_exchange_size, exclude=(sender,), for_host=request.remote_addr)
+            return jsonify({"peers": sample}), 200
 
         @self.app.route('/status', methods=['GET'])
         def get_status():
@@ -57,8 +199,73 @@ class NetworkServer:
                 "accounts_count": len(self.account_mgr.accounts)
             }), 200
 
+    def _references_body(self, user_id, since):
+        """Snapshot das referências mais as sequências (em faixas) que têm manifesto de chunks."""
+        data = self.account_mgr.service.references.snapshot(user_id, since)
+        chunked = self.account_mgr.chunks.sequences(user_id, since)
+        if chunked:
+            data["chunked"] = to_runs(chunked)
+        return data
+
+    def _cached_json(self, key, etag, build):
+        """Resposta JSON servida do cache; `build` só roda quando o ETag mudou."""
+        entry = self.response_cache.get(key, etag)
+        if entry is None:
+            entry = self.response_cache.put(key, etag, self.app.json.dumps(build(), separators=(",", ":")).encode("utf-8"))
+
+        if entry.gzipped is not None and "gzip" in request.accept_encodings:
+            response = Response(entry.gzipped, mimetype="application/json")
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = Response(entry.body, mimetype="application/json")
+        response.vary.add("Accept-Encoding")
+        response.set_etag(etag)
+        return response
+
+    def _send_envelope(self, file_path, file_wrapper):
+        """Resposta 200/206 cujo corpo é o próprio arquivo posicionado no início da faixa.
+
+        O Gunicorn reconhece o wsgi.file_wrapper e envia `Content-Length` bytes a partir da
+        posição atual com os.sendfile; o send_file do Flask embrulharia a faixa em um iterador
+        Python e perderia o zero-copy nas retomadas (Range).
+        """
+        size = file_path.stat().st_size
+        start, end = 0, size
+        status = 200
+        if request.range is not None:
+            byte_range = request.range.range_for_length(size)
+            if byte_range is None:
+                response = Response(status=416)
+                response.headers["Content-Range"] = f"bytes */{size}"
+                return response
+            start, end = byte_range
+            status = 206
+
+        f = open(file_path, "rb")
+        f.seek(start)
+        response = Response(
+            file_wrapper(f, CHUNK_SIZE),
+            status=status,
+            mimetype="application/octet-stream",
+            direct_passthrough=True
+        )
+        response.headers["Content-Length"] = str(end - start)
+        response.headers["Accept-Ranges"] = "bytes"
+        response.headers["Content-Disposition"] = f"attachment; filename={file_path.name}"
+        if status == 206:
+            response.headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+        return response
+
+    def _sender_address(self, sender):
+        """Nó escutando em 0.0.0.0 (ou em loopback, visto de outra máquina) anuncia um host
+        inútil para nós: usa o IP de origem da conexão."""
+        host, port = sender.rsplit(":", 1)
+        if is_wildcard_host(host) or (is_loopback_host(host) and not is_loopback_host(request.remote_addr)):
+            return f"{request.remote_addr}:{port}"
+        return sender
+
     def start(self):
-        """Inicia o servidor Flask no host e porta configurados."""
+        """Inicia o servidor de desenvolvimento do Flask (SERVER_MODE=development ou sem Gunicorn)."""
         print(f"[*] Network Server ativo em http://{self.config.node_host}:{self.config.node_port}")
         # threaded=True permite lidar com múltiplas requisições de sincronização
         self.app.run(
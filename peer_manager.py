@@ -1,78 +1,326 @@
-import json
 import time
+import atexit
+import random
+import threading
 from pathlib import Path
+from metadata_store import JsonMetadataStore
+
+
+def _host_of(peer_address) -> str:
+    return peer_address.rsplit(":", 1)[0].strip("[]")
+
+
+def is_loopback_host(host) -> bool:
+    return host == "localhost" or host == "::1" or host.startswith("127.")
+
+
+def is_wildcard_host(host) -> bool:
+    return host in ("", "0.0.0.0", "::")
+
+
+class PeerHealth:
+    """Saúde de um peer observada pelo cliente de sincronização (apenas em memória)."""
+
+    def __init__(self):
+        self.rtt = None                 # média móvel do tempo de resposta (s)
+        self.success_rate = 1.0         # média móvel de sucessos (1.0 = sempre responde)
+        self.consecutive_failures = 0
+        self.throughput = None          # média móvel da vazão de download (bytes/s)
+        self.last_changed = None        # última vez que o peer trouxe algo novo
+        self.next_due = 0.0             # próxima sincronização (time.monotonic)
+
+    def score(self) -> float:
+        """Peers que respondem sempre e rápido vêm primeiro quando há mais peers que vagas."""
+        return self.success_rate / (self.rtt or 0.05)
+
 
 class PeerManager:
-    def __init__(self, config, peers_file="data/system/peers.json"):
+    def __init__(self, config, peers_file="data/system/peers.json", store=None):
         self.config = config
         self.peers_file = Path(peers_file)
+        # Backend de metadados; sem um store injetado, usa o peers.json diretamente
+        self.store = store if store is not None else JsonMetadataStore(None, peers_file=self.peers_file)
         # Mudamos para dict para armazenar o timestamp: { "ip:port": last_seen }
         self.peers = {} 
+        # Protege a visão: threads do servidor (/peers, /announce), agendador e GC a alteram juntos
+        self._view_lock = threading.RLock()
         self.expire_time = 3600  # 1 hora para expiração (ajustável)
+        # Saúde por peer, usada pelo agendador do NetworkClient: { "ip:port": PeerHealth }
+        self.health = {}
+        self._health_lock = threading.Lock()
+        self.my_address = f"{config.node_host}:{config.node_port}"
+        # Callbacks chamados com os endereços que saíram da visão (ex: caches por peer do cliente)
+        self._removed_listeners = []
+
+        # Gravações agrupadas: novos peers só marcam a visão como alterada
+        self._dirty = False
+        self._flush_event = threading.Event()
         
         self.peers_file.parent.mkdir(parents=True, exist_ok=True)
         self._load_peers()
 
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
     def _load_peers(self):
-        """Carrega a lista de IPs do disco."""
-        if self.peers_file.exists():
-            try:
-                with open(self.peers_file, "r", encoding="utf-8") as f:
-                    # Carrega e garante que temos um dicionário com timestamps
-                    data = json.load(f)
-                    if isinstance(data, list):
-                        self.peers = {peer: time.time() for peer in data}
-                    else:
-                        self.peers = data
-                print(f"[*] {len(self.peers)} peers carregados.")
-            except Exception as e:
-                print(f"[!] Erro ao carregar peers.json: {e}")
-                self.peers = {}
+        """Carrega a lista de IPs do backend de metadados."""
+        try:
+            data = self.store.load_peers()
+        except Exception as e:
+            print(f"[!] Erro ao carregar peers: {e}")
+            self.peers = {}
+            return
+
+        if data is not None:
+            # Carrega e garante que temos um dicionário com timestamps
+            if isinstance(data, list):
+                self.peers = {peer: time.time() for peer in data}
+            else:
+                self.peers = data
+            print(f"[*] {len(self.peers)} peers carregados.")
         else:
             seeds = self.config.seeds if hasattr(self.config, 'seeds') else []
             self.peers = {peer: time.time() for peer in seeds}
             self._save_peers()
 
     def _save_peers(self):
-        """Salva a lista no disco."""
+        """Salva a lista no backend de metadados."""
         try:
-            with open(self.peers_file, "w", encoding="utf-8") as f:
-                json.dump(self.peers, f, indent=4)
+            with self._view_lock:
+                peers = dict(self.peers)
+            self.store.save_peers(peers)
         except Exception as e:
-            print(f"[!] Erro ao salvar peers.json: {e}")
+            print(f"[!] Erro ao salvar peers: {e}")
+
+    def _mark_dirty(self):
+        self._dirty = True
+        self._flush_event.set()
+
+    def flush(self):
+        """Grava a visão de peers se ela mudou desde a última gravação."""
+        if self._dirty:
+            self._dirty = False
+            self._save_peers()
+
+    def _flush_loop(self):
+        while True:
+            self._flush_event.wait()
+            # Vários peers novos na janela viram uma única gravação
+            time.sleep(self.config.peers_flush_interval)
+            self._flush_event.clear()
+            self.flush()
 
     def get_all_targets(self):
         """Retorna apenas os endereços (keys do dict)."""
-        return list(self.peers.keys())
+        with self._view_lock:
+            return list(self.peers.keys())
+
+    def add_removed_listener(self, callback):
+        """Registra callback(endereços) chamado quando peers saem da visão (substituição ou GC)."""
+        self._removed_listeners.append(callback)
+
+    def _notify_removed(self, peer_addresses):
+        for callback in self._removed_listeners:
+            try:
+                callback(peer_addresses)
+            except Exception as e:
+                print(f"[!] Erro em listener de peers removidos: {e}")
+
+    # --- SAÚDE E AGENDAMENTO ---
+
+    def _get_health(self, peer_address) -> PeerHealth:
+        health = self.health.get(peer_address)
+        if health is None:
+            health = self.health[peer_address] = PeerHealth()
+        return health
+
+    def record_success(self, peer_address, rtt, changed=False):
+        """Registra uma sincronização bem-sucedida e agenda a próxima."""
+        now = time.monotonic()
+        with self._health_lock:
+            health = self._get_health(peer_address)
+            health.rtt = rtt if health.rtt is None else 0.8 * health.rtt + 0.2 * rtt
+            health.success_rate = 0.8 * health.success_rate + 0.2
+            health.consecutive_failures = 0
+            if changed:
+                health.last_changed = now
+            health.next_due = now + self._next_interval(health, now)
+
+        with self._view_lock:
+            if peer_address in self.peers:
+                # Peer respondeu: conta como visto (sem regravar o arquivo a cada rodada)
+                self.peers[peer_address] = time.time()
+
+    def record_failure(self, peer_address):
+        """Registra uma falha e afasta a próxima tentativa (backoff exponencial). Retorna o nº de falhas seguidas."""
+        now = time.monotonic()
+        with self._health_lock:
+            health = self._get_health(peer_address)
+            health.success_rate = 0.8 * health.success_rate
+            health.consecutive_failures += 1
+            health.next_due = now + self._next_interval(health, now)
+            return health.consecutive_failures
+
+    def record_throughput(self, peer_address, received_bytes, elapsed):
+        """Atualiza a vazão medida em um download (usada para escolher as fontes)."""
+        if received_bytes <= 0 or elapsed <= 0:
+            return
+        rate = received_bytes / elapsed
+        with self._health_lock:
+            health = self._get_health(peer_address)
+            health.throughput = rate if health.throughput is None else 0.7 * health.throughput + 0.3 * rate
+
+    def get_throughput(self, peer_address) -> float:
+        with self._health_lock:
+            health = self.health.get(peer_address)
+            return (health.throughput or 0.0) if health else 0.0
+
+    def is_healthy(self, peer_address) -> bool:
+        """Peer sem falhas recentes (desconhecidos contam como saudáveis)."""
+        with self._health_lock:
+            health = self.health.get(peer_address)
+            return health is None or health.consecutive_failures == 0
+
+    def _next_interval(self, health, now) -> float:
+        """Intervalo até a próxima sincronização do peer, com jitter de ±20%."""
+        base = self.config.sync_interval
+        if health.consecutive_failures:
+            # Peer fora do ar: dobra a espera a cada falha, até o teto
+            interval = min(self.config.sync_max_backoff, base * 2 ** (health.consecutive_failures - 1))
+        elif health.last_changed is not None and now - health.last_changed < base * 10:
+            # Peer com novidades recentes é consultado com mais frequência
+            interval = self.config.sync_min_interval
+        else:
+            interval = base
+        return interval * random.uniform(0.8, 1.2)
+
+    def get_due_targets(self, exclude=()):
+        """Peers cuja próxima sincronização já venceu, dos mais saudáveis para os menos."""
+        now = time.monotonic()
+        peers = self.get_all_targets()
+        with self._health_lock:
+            due = [
+                (self._get_health(addr), addr) for addr in peers
+                if addr not in exclude and self._get_health(addr).next_due <= now
+            ]
+        due.sort(key=lambda item: item[0].score(), reverse=True)
+        return [addr for _, addr in due]
+
+    def seconds_until_next_due(self) -> float:
+        """Tempo até o próximo peer vencer (limita o sono do agendador)."""
+        now = time.monotonic()
+        peers = self.get_all_targets()
+        with self._health_lock:
+            dues = [self._get_health(addr).next_due for addr in peers]
+        return max(0.0, min(dues, default=now + self.config.sync_interval) - now)
+
+    # --- VISÃO PARCIAL (GOSSIP) ---
+
+    def gossip_enabled(self) -> bool:
+        mode = self.config.sync_mode
+        return mode == "gossip" or (mode == "auto" and len(self.peers) > self.config.gossip_fanout)
+
+    def sample_targets(self, count, exclude=()):
+        """Sorteia até `count` peers da visão cuja próxima sincronização já venceu (respeita o backoff)."""
+        due = self.get_due_targets(exclude=exclude)
+        return random.sample(due, min(count, len(due)))
+
+    def _routable_for(self, peer_address, other_host) -> bool:
+        """Endereço utilizável pelo nó em `other_host`: nunca curinga; loopback só na mesma máquina."""
+        if not isinstance(peer_address, str) or ":" not in peer_address:
+            return False
+        host = _host_of(peer_address)
+        if is_wildcard_host(host):
+            return False
+        return not is_loopback_host(host) or other_host is None or is_loopback_host(other_host)
+
+    def sample_view(self, count, exclude=(), for_host=None):
+        """Amostra aleatória da visão para trocar com o peer em `for_host` (inclui o próprio endereço).
+
+        Só vão endereços que o peer consegue usar: um nó escutando em 0.0.0.0 não se anuncia
+        (o outro lado usa o IP de origem da conexão) e endereços loopback não saem da máquina.
+        """
+        view = [
+            addr for addr in self.get_all_targets()
+            if addr not in exclude and self._routable_for(addr, for_host) and self.is_healthy(addr)
+        ]
+        sample = random.sample(view, min(count, len(view)))
+        if self._routable_for(self.my_address, for_host):
+            sample.append(self.my_address)
+        return sample
+
+    def merge_peers(self, peer_addresses, origin_host=None):
+        """Incorpora os endereços recebidos do peer em `origin_host`; retorna quantos eram novos."""
+        added = 0
+        with self._view_lock:
+            for peer_address in peer_addresses:
+                if not self._routable_for(peer_address, origin_host) or peer_address in self.peers:
+                    continue
+                if self._add_to_view(peer_address):
+                    added += 1
+        return added
+
+    def _add_to_view(self, peer_address) -> bool:
+        if not peer_address or ":" not in peer_address or peer_address == self.my_address:
+            return False
+
+        seeds = getattr(self.config, 'seeds', [])
+        victim = None
+        with self._view_lock:
+            if peer_address in self.peers:
+                return False
+            if len(self.peers) >= self.config.peer_view_size:
+                # Visão cheia: cede lugar a um peer dinâmico sorteado (seeds nunca saem)
+                evictable = [addr for addr in self.peers if addr not in seeds]
+                if not evictable:
+                    return False
+                victim = random.choice(evictable)
+                del self.peers[victim]
+                with self._health_lock:
+                    self.health.pop(victim, None)
+
+            self.peers[peer_address] = time.time()
+        if victim is not None:
+            self._notify_removed([victim])
+        self._mark_dirty()
+        return True
 
     def add_peer_by_address(self, peer_address):
-        """Implementação pendente: Adiciona ou atualiza o timestamp do peer."""
+        """Adiciona o peer à visão ou atualiza o timestamp de quem já está nela."""
         if not peer_address or ":" not in peer_address:
             return False
-            
-        is_new = peer_address not in self.peers
-        self.peers[peer_address] = time.time() # Atualiza o 'last_seen'
-        
-        if is_new:
-            self._save_peers()
+
+        with self._view_lock:
+            if peer_address in self.peers:
+                self.peers[peer_address] = time.time() # Atualiza o 'last_seen'
+                return True
+
+        if self._add_to_view(peer_address):
             print(f"[*] Novo peer descoberto: {peer_address}")
-        return True
+            return True
+        return False
 
     def run_garbage_collector(self):
         """Remove vizinhos inativos, exceto os peers 'seeds' de confiança."""
         now = time.time()
         seeds = getattr(self.config, 'seeds', [])
         
-        # Condição: o peer deve estar inativo E não pode ser um seed
-        to_remove = [
-            addr for addr, last_seen in self.peers.items() 
-            if (now - last_seen > self.expire_time) and (addr not in seeds)
-        ]
-        
-        if to_remove:
+        with self._view_lock:
+            # Condição: o peer deve estar inativo E não pode ser um seed
+            to_remove = [
+                addr for addr, last_seen in list(self.peers.items())
+                if (now - last_seen > self.expire_time) and (addr not in seeds)
+            ]
             for addr in to_remove:
                 del self.peers[addr]
+                with self._health_lock:
+                    self.health.pop(addr, None)
+
+        if to_remove:
+            for addr in to_remove:
                 print(f"[-] GC: Peer dinâmico removido: {addr}", flush=True)
-            self._save_peers()
+            self._notify_removed(to_remove)
+            self._mark_dirty()
             return True
         return False
\ No newline at end of file
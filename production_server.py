@@ -0,0 +1,55 @@
+import os
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    # Gunicorn não instalado (ou Windows): o nó continua no servidor de desenvolvimento do Flask
+    BaseApplication = None
+
+
+def is_available() -> bool:
+    return BaseApplication is not None and os.name == "posix"
+
+
+if BaseApplication is not None:
+
+    class ProductionServer(BaseApplication):
+        """Gunicorn (worker gthread) servindo as mesmas rotas do NetworkServer.
+
+        O nó inteiro é montado por `factory` dentro do processo worker, depois do fork:
+        threads de background, índice em memória e locks não sobrevivem a um fork, por isso
+        há um único processo e a concorrência vem do pool de threads com keep-alive.
+        Envelopes saem via wsgi.file_wrapper, que o gthread entrega com os.sendfile.
+        """
+
+        def __init__(self, config, factory):
+            self.config = config
+            self.factory = factory
+            super().__init__()
+
+        def load_config(self):
+            options = {
+                "bind": f"{self.config.node_host}:{self.config.node_port}",
+                "workers": 1,
+                "worker_class": "gthread",
+                "threads": self.config.server_threads,
+                "keepalive": self.config.server_keepalive,
+                "backlog": self.config.server_backlog,
+                # Transferências longas rodam em threads; o worker segue respondendo ao arbiter
+                "timeout": 120,
+                "graceful_timeout": 10,
+                "sendfile": True,
+                "accesslog": "-" if self.config.debug else None,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.factory().app
+
+
+def run(config, factory):
+    """Sobe o nó no Gunicorn; `factory()` monta o nó e retorna o NetworkServer."""
+    print(f"[*] Network Server (produção) em http://{config.node_host}:{config.node_port} "
+          f"com {config.server_threads} threads e keep-alive de {config.server_keepalive}s")
+    ProductionServer(config, factory).run()
@@ -0,0 +1,329 @@
+import re
+import time
+import atexit
+import bisect
+import hashlib
+import threading
+from datetime import datetime
+
+ENVELOPE_PATTERN = re.compile(r"^(\d+)\.dat\.gz$")
+CHAIN_GENESIS = "0" * 64
+
+
+def to_runs(sequences) -> list:
+    """Compacta sequências ordenadas em faixas [[início, fim], ...] (run-length)."""
+    runs = []
+    for seq in sequences:
+        if runs and seq == runs[-1][1] + 1:
+            runs[-1][1] = seq
+        else:
+            runs.append([seq, seq])
+    return runs
+
+
+def subtract_runs(runs, other_runs) -> list:
+    """Faixas de `runs` que não estão em `other_runs` (ambas ordenadas), em O(número de faixas)."""
+    missing = []
+    j = 0
+    for start, end in runs:
+        cursor = start
+        while j < len(other_runs) and other_runs[j][1] < cursor:
+            j += 1
+        k = j
+        while cursor <= end:
+            if k >= len(other_runs) or other_runs[k][0] > end:
+                missing.append([cursor, end])
+                break
+            o_start, o_end = other_runs[k]
+            if o_start > cursor:
+                missing.append([cursor, o_start - 1])
+            cursor = max(cursor, o_end + 1)
+            k += 1
+    return missing
+
+
+def chain_step(previous, sequence, file_hash) -> str:
+    """Elo da cadeia de hashes: digest(k) = SHA-256(digest(k-1) : k : hash do envelope k)."""
+    return hashlib.sha256(f"{previous}:{sequence}:{file_hash or ''}".encode()).hexdigest()
+
+
+class _UserReferences:
+    """Estado em memória das referências de um usuário."""
+
+    def __init__(self, user_id, folder):
+        self.user_id = user_id
+        self.folder = folder
+        self.data = {"user": user_id, "sequence": 0, "files": [], "last_sync": ""}
+        self.seqs = []          # sequências ordenadas (espelha data["files"])
+        self.by_seq = {}        # índice seq -> entrada
+        self.pending = []       # entradas ainda não persistidas no backend
+        self.chain = [CHAIN_GENESIS]  # chain[k] = digest do histórico contíguo 1..k
+        self.held = None        # cache das faixas de sequências presentes (run-length)
+        self.log_entries = 0    # linhas no log desde a última compactação (backend JSON)
+        self.version = 0        # incrementa a cada mudança; compõe o ETag do servidor
+        self.store_version = None  # token do backend na última leitura/gravação nossa
+        self.checked_at = 0.0
+        self.dirty = False
+
+
+class ReferencesIndex:
+    """Índice em memória das referências, compartilhado por Manager, Service e Server.
+
+    Leituras são servidas da memória; o backend só é relido quando sua versão muda
+    (reinício ou edição externa). Novas entradas são persistidas em lotes por uma thread
+    de write-behind; no backend JSON elas vão para o references.log, compactado
+    periodicamente no references.json.
+    """
+
+    def __init__(self, storage_provider, config):
+        self.storage = storage_provider
+        self.store = storage_provider.metadata
+        self.config = config
+        self._users = {}
+        self._lock = threading.RLock()
+        # Identifica esta execução do processo: versões não se repetem entre reinícios
+        self.epoch = f"{int(time.time() * 1000):x}"
+
+        # Serializa as gravações no backend sem travar leituras e commits durante o I/O
+        self._flush_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    # --- LEITURA ---
+
+    def _get(self, user_id) -> _UserReferences:
+        """Retorna o estado do usuário, recarregando do disco se o arquivo mudou por fora."""
+        # Caminho rápido sem lock: usuário já carregado e checado há pouco (leitura de dict é atômica)
+        refs = self._users.get(user_id)
+        if refs is not None and (refs.dirty or time.monotonic() - refs.checked_at < self.config.references_recheck_interval):
+            return refs
+
+        with self._lock:
+            refs = self._users.get(user_id)
+            if refs is None:
+                # Só é publicado depois de carregado e recuperado: o caminho rápido nunca vê um mapa parcial
+                refs = _UserReferences(user_id, self.storage.get_user_storage_path(user_id))
+                self._load(refs)
+                self._recover_unreferenced(refs)
+                self._users[user_id] = refs
+                return refs
+
+            now = time.monotonic()
+            if not refs.dirty and now - refs.checked_at >= self.config.references_recheck_interval:
+                if self.store.references_version(user_id) != refs.store_version:
+                    self._load(refs)
+                # Por último: até aqui as leituras sem lock esperam a checagem
+                refs.checked_at = time.monotonic()
+            return refs
+
+    def get_sequence(self, user_id) -> int:
+        return self._get(user_id).data.get("sequence", 0)
+
+    def has(self, user_id, sequence) -> bool:
+        return sequence in self._get(user_id).by_seq
+
+    def get_hash(self, user_id, sequence):
+        entry = self._get(user_id).by_seq.get(sequence)
+        return entry.get("hash") if entry else None
+
+    def get_version(self, user_id) -> str:
+        refs = self._get(user_id)
+        return f"{self.epoch}-{refs.version}"
+
+    def get_hashes(self, user_id) -> dict:
+        """Mapa seq -> hash do usuário."""
+        with self._lock:
+            refs = self._get(user_id)
+            return {seq: entry.get("hash") for seq, entry in refs.by_seq.items()}
+
+    def get_digest(self, user_id, sequence=None) -> dict:
+        """Raiz da cadeia de hashes (prefixo contíguo) e, opcionalmente, o digest em `sequence`."""
+        with self._lock:
+            refs = self._get(user_id)
+            head = len(refs.chain) - 1
+            digest = {"user": user_id, "head": head, "root": refs.chain[head]}
+            if sequence is not None:
+                digest["seq"] = sequence
+                digest["digest"] = refs.chain[sequence] if 0 <= sequence <= head else None
+            return digest
+
+    def get_held(self, user_id) -> list:
+        """Sequências realmente presentes, em faixas [[início, fim], ...]."""
+        with self._lock:
+            refs = self._get(user_id)
+            if refs.held is None:
+                refs.held = to_runs(refs.seqs)
+            return refs.held
+
+    def get_missing(self, user_id, remote_runs) -> list:
+        """Sequências que o peer anuncia (em faixas) e que não existem localmente."""
+        missing_runs = subtract_runs(remote_runs, self.get_held(user_id))
+        return [seq for start, end in missing_runs for seq in range(start, end + 1)]
+
+    def snapshot(self, user_id, since=0) -> dict:
+        """Cópia do mapa de referências (apenas entradas após `since`, se informado)."""
+        with self._lock:
+            refs = self._get(user_id)
+            data = dict(refs.data)
+            start = bisect.bisect_right(refs.seqs, since) if since > 0 else 0
+            data["files"] = refs.data["files"][start:]
+            data["held"] = self.get_held(user_id)
+            if since > 0:
+                data["since"] = since
+            return data
+
+    # --- ESCRITA ---
+
+    def add_file(self, user_id, sequence, file_hash):
+        """Registra um envelope na memória; a gravação em disco acontece no próximo flush."""
+        self.add_files(user_id, [(sequence, file_hash)])
+
+    def add_files(self, user_id, items):
+        """Registra um lote [(seq, hash), ...] com uma única versão nova e um único avanço da cadeia."""
+        with self._lock:
+            self._add_entries(self._get(user_id), items)
+        self._flush_event.set()
+
+    def _add_entries(self, refs, items):
+        """Aplica o lote ao estado do usuário (chamado com o lock do índice)."""
+        data = refs.data
+        now = datetime.now()
+
+        for sequence, file_hash in items:
+            # Atualiza dados de sincronização
+            data["sequence"] = max(data["sequence"], sequence)
+
+            # Evita duplicar metadados do mesmo arquivo (consulta O(1) no índice por seq)
+            if sequence not in refs.by_seq:
+                entry = {
+                    "seq": sequence,
+                    "hash": file_hash,
+                    "ts": int(now.timestamp())
+                }
+                self._insert_entry(refs, entry)
+                refs.pending.append(entry)
+
+        data["last_sync"] = str(now)
+        self._extend_chain(refs)
+        refs.version += 1
+        refs.dirty = True
+
+    def _insert_entry(self, refs, entry):
+        """Insere mantendo a ordem por seq (O(1) no caso comum de sequências crescentes)."""
+        sequence = entry["seq"]
+        refs.by_seq[sequence] = entry
+        refs.held = None
+        if not refs.seqs or refs.seqs[-1] < sequence:
+            refs.seqs.append(sequence)
+            refs.data["files"].append(entry)
+        else:
+            pos = bisect.bisect_left(refs.seqs, sequence)
+            refs.seqs.insert(pos, sequence)
+            refs.data["files"].insert(pos, entry)
+
+    def _extend_chain(self, refs):
+        """Avança a cadeia enquanto o histórico for contíguo (preenche lacunas quando chegam)."""
+        head = len(refs.chain) - 1
+        while head + 1 in refs.by_seq:
+            head += 1
+            refs.chain.append(chain_step(refs.chain[-1], head, refs.by_seq[head].get("hash")))
+        # Guardado junto das referências: vai para o snapshot e para as respostas do /references
+        refs.data["chain"] = {"head": head, "root": refs.chain[head]}
+
+    def flush(self):
+        """Persiste as entradas pendentes e compacta os logs que passaram do limite."""
+        with self._flush_lock:
+            # Sob o lock do índice só se separa o que gravar; o I/O acontece fora dele
+            with self._lock:
+                batches = []
+                for refs in self._users.values():
+                    if refs.dirty:
+                        batches.append((refs, refs.pending, dict(refs.data)))
+                        refs.pending = []
+
+            for refs, pending, data in batches:
+                try:
+                    if pending:
+                        # Custo proporcional apenas às entradas novas
+                        self.store.append_references(refs.user_id, pending, data)
+                        refs.log_entries += len(pending)
+
+                    # O gatilho cresce com o snapshot: cada reescrita completa é paga por pelo menos
+                    # metade do seu tamanho em appends (custo amortizado constante por entrada)
+                    if (self.store.compacts_references and refs.log_entries >= max(
+                            self.config.references_compact_threshold, len(refs.data["files"]) // 2)):
+                        with self._lock:
+                            # O snapshot pode incluir entradas ainda pendentes; o log é deduplicado por seq
+                            data = dict(refs.data, files=list(refs.data["files"]))
+                        self.store.compact_references(refs.user_id, data)
+                        refs.log_entries = 0
+
+                    with self._lock:
+                        refs.store_version = self.store.references_version(refs.user_id)
+                        # Entradas chegadas durante a gravação ficam para o próximo flush
+                        refs.dirty = bool(refs.pending)
+                except Exception as e:
+                    with self._lock:
+                        # Devolve as entradas para a próxima tentativa
+                        refs.pending = pending + refs.pending
+                    print(f"[!] Erro ao gravar referências de {refs.user_id}: {e}")
+
+    def _flush_loop(self):
+        while True:
+            self._flush_event.wait()
+            # Agrupa as alterações que chegarem durante a janela em uma única gravação
+            time.sleep(self.config.references_flush_interval)
+            self._flush_event.clear()
+            self.flush()
+
+    # --- BACKEND ---
+
+    def _load(self, refs):
+        """(Re)carrega as referências do usuário a partir do backend de metadados.
+
+        O novo estado é montado à parte e trocado de uma vez: leituras sem lock veem
+        o mapa antigo completo ou o novo completo, nunca um mapa pela metade.
+        """
+        store_version = self.store.references_version(refs.user_id)
+        data, log_entries = self.store.load_references(refs.user_id)
+
+        files = data.get("files", [])
+        data["files"] = []
+        fresh = _UserReferences(refs.user_id, refs.folder)
+        fresh.data = data
+        for entry in sorted(files, key=lambda f_meta: f_meta["seq"]):
+            if entry["seq"] not in fresh.by_seq:
+                self._insert_entry(fresh, entry)
+
+        # A cadeia é recalculada a partir das entradas (o valor gravado é só informativo)
+        self._extend_chain(fresh)
+
+        refs.by_seq = fresh.by_seq
+        refs.seqs = fresh.seqs
+        refs.chain = fresh.chain
+        refs.held = None
+        refs.data = fresh.data
+        refs.pending = []
+        refs.store_version = store_version
+        refs.log_entries = log_entries
+        refs.version += 1
+        refs.checked_at = time.monotonic()
+
+    def _recover_unreferenced(self, refs):
+        """Registra envelopes presentes na pasta mas ausentes do mapa (ex: queda antes do flush)."""
+        known = refs.by_seq
+        for file in refs.folder.iterdir():
+            match = ENVELOPE_PATTERN.match(file.name)
+            if not match or int(match.group(1)) in known:
+                continue
+
+            hasher = hashlib.sha256()
+            with open(file, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    hasher.update(block)
+            print(f"[*] References: recuperando {file.name} de {refs.user_id} ausente do mapa")
+            # Direto no estado ainda não publicado (add_file buscaria o usuário no índice)
+            self._add_entries(refs, [(int(match.group(1)), hasher.hexdigest())])
+            self._flush_event.set()
@@ -0,0 +1,88 @@
+import gzip
+import threading
+from collections import OrderedDict
+
+
+class CachedResponse:
+    """Corpo já serializado de uma resposta e, se valer a pena, sua versão gzip."""
+
+    __slots__ = ("etag", "body", "gzipped")
+
+    def __init__(self, etag, body, gzipped=None):
+        self.etag = etag
+        self.body = body
+        self.gzipped = gzipped
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + (len(self.gzipped) if self.gzipped else 0)
+
+
+class ResponseCache:
+    """Cache LRU dos corpos de resposta do NetworkServer, limitado em bytes.
+
+    Cada entrada guarda o ETag com que foi gerada: uma consulta com ETag diferente é
+    tratada como ausente, então uma invalidação atrasada nunca serve dados velhos.
+    As invalidações por usuário servem para liberar memória assim que algo muda.
+    """
+
+    def __init__(self, max_bytes, gzip_min_size=1024, gzip_level=6):
+        self.max_bytes = max_bytes
+        self.gzip_min_size = gzip_min_size
+        self.gzip_level = gzip_level
+        self.size = 0
+        self._entries = OrderedDict()
+        # usuário -> chaves dele, para invalidar sem varrer o cache inteiro
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, etag):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.etag != etag:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, etag, body: bytes) -> CachedResponse:
+        gzipped = None
+        if len(body) >= self.gzip_min_size:
+            # mtime=0: o mesmo corpo gera sempre os mesmos bytes comprimidos
+            gzipped = gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+        entry = CachedResponse(etag, body, gzipped)
+
+        # Respostas maiores que o limite inteiro são servidas, mas não guardadas
+        if entry.size > self.max_bytes:
+            return entry
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self.size += entry.size
+            if len(key) > 1:
+                self._by_user.setdefault(key[1], set()).add(key)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+        return entry
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= entry.size
+        if len(key) > 1:
+            keys = self._by_user.get(key[1])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_user[key[1]]
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_user(self, user_id):
+        """Remove as entradas do usuário (chaves no formato (rota, usuário, ...))."""
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                self._remove(key)
@@ -1,5 +1,10 @@
 import hashlib
+import threading
+from collections import OrderedDict
 from pathlib import Path
+from metadata_store import create_metadata_store
+from blob_store import BlobStore
+from user_locks import StripedLocks
 
 class StorageProvider:
     def __init__(self, config):
@@ -8,10 +13,28 @@ class StorageProvider:
         self.base_storage = Path("data/storage")
         self.base_system = Path("data/system")
         self.base_inbound = Path("data/inbound")
+        # Fica fora de data/storage para não ser tratado como pasta de usuário pelo GC
+        self.base_blobs = Path("data/blobs")
         
+        # Cache LRU de caminhos resolvidos: evita recalcular o SHA-256 e repetir o mkdir
+        self._path_cache = OrderedDict()
+        self._path_cache_size = getattr(config, 'path_cache_size', 100000)
+        self._path_lock = threading.Lock()
+
+        # Locks por pasta de usuário: commits, sequências e limpeza do GC (seções curtas)
+        self.locks = StripedLocks(getattr(config, 'lock_stripes', 1024))
+        # Conjunto separado para transferências longas, que não pode travar os commits
+        self.transfer_locks = StripedLocks(getattr(config, 'lock_stripes', 1024))
+
         # Garante a existência da infraestrutura física
         self._ensure_base_dirs()
 
+        # Envelopes endereçados por conteúdo (hardlinks deduplicados entre usuários e peers)
+        self.blobs = BlobStore(self.base_blobs)
+
+        # Backend de metadados (contas, peers e referências): JSON ou SQLite
+        self.metadata = create_metadata_store(self, config)
+
     def _ensure_base_dirs(self):
         """Cria as pastas fundamentais se não existirem."""
         for path in [self.base_storage, self.base_system, self.base_inbound]:
@@ -19,18 +42,71 @@ class StorageProvider:
 
     def get_user_folder_name(self, user_id: str) -> str:
         """Resolve o nome da pasta baseado na preferência de privacidade (Hash)."""
+        entry = self._cached(user_id)
+        if entry is not None:
+            return entry[0].name
+        return self._compute_folder_name(user_id)
+
+    def _compute_folder_name(self, user_id: str) -> str:
         if hasattr(self.config, 'use_plain_names') and self.config.use_plain_names:
             return user_id
         return hashlib.sha256(user_id.encode()).hexdigest()
 
+    def _cached(self, user_id: str):
+        """Consulta o cache LRU de caminhos (sem syscalls)."""
+        with self._path_lock:
+            entry = self._path_cache.get(user_id)
+            if entry is not None:
+                self._path_cache.move_to_end(user_id)
+            return entry
+
+    def _resolve(self, user_id: str):
+        """Resolve e memoriza [storage, inbound, storage_criada, inbound_criada] do usuário."""
+        entry = self._cached(user_id)
+        if entry is None:
+            folder_name = self._compute_folder_name(user_id)
+            entry = [self.base_storage / folder_name, self.base_inbound / folder_name, False, False]
+            with self._path_lock:
+                entry = self._path_cache.setdefault(user_id, entry)
+                while len(self._path_cache) > self._path_cache_size:
+                    self._path_cache.popitem(last=False)
+        return entry
+
+    def user_lock(self, user_id: str):
+        """Lock da pasta do usuário (o mesmo que o GC usa pelo nome da pasta)."""
+        return self.locks.for_key(self.get_user_folder_name(user_id))
+
+    def folder_lock(self, folder_name: str):
+        return self.locks.for_key(folder_name)
+
+    def transfer_lock(self, user_id: str):
+        """Lock de download do usuário: um peer por vez baixa os envelopes dele."""
+        return self.transfer_locks.for_key(self.get_user_folder_name(user_id))
+
+    def provision_user(self, user_id: str):
+        """Cria as pastas do usuário uma única vez (ao registrar a conta)."""
+        with self.user_lock(user_id):
+            self.get_user_storage_path(user_id)
+            self.get_user_inbound_path(user_id)
+
+    def forget_folder(self, folder_name: str):
+        """Remove do cache os usuários de uma pasta apagada (ex: pelo GC)."""
+        with self._path_lock:
+            for user_id in [u for u, entry in self._path_cache.items() if entry[0].name == folder_name]:
+                del self._path_cache[user_id]
+
     def get_user_storage_path(self, user_id: str) -> Path:
         """Retorna o caminho da pasta de arquivos finais do usuário."""
-        path = self.base_storage / self.get_user_folder_name(user_id)
-        path.mkdir(parents=True, exist_ok=True)
-        return path
+        entry = self._resolve(user_id)
+        if not entry[2]:
+            entry[0].mkdir(parents=True, exist_ok=True)
+            entry[2] = True
+        return entry[0]
 
     def get_user_inbound_path(self, user_id: str) -> Path:
         """Retorna o caminho da pasta onde o usuário 'solta' arquivos novos."""
-        path = self.base_inbound / self.get_user_folder_name(user_id)
-        path.mkdir(parents=True, exist_ok=True)
-        return path
\ No newline at end of file
+        entry = self._resolve(user_id)
+        if not entry[3]:
+            entry[1].mkdir(parents=True, exist_ok=True)
+            entry[3] = True
+        return entry[1]
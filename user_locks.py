@@ -0,0 +1,18 @@
+import zlib
+import threading
+
+
+class StripedLocks:
+    """Conjunto fixo de locks reentrantes indexados pelo hash da chave (lock striping).
+
+    Chaves diferentes quase sempre caem em locks diferentes, então usuários distintos
+    avançam em paralelo; a mesma chave sempre usa o mesmo lock. A memória não cresce
+    com o número de usuários.
+    """
+
+    def __init__(self, stripes=1024):
+        self._locks = [threading.RLock() for _ in range(max(stripes, 1))]
+
+    def for_key(self, key: str):
+        # crc32: barato e com boa distribuição para ids e hashes de pasta
+        return self._locks[zlib.crc32(key.encode()) % len(self._locks)]